@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Time the readers of PORAIPHydrography per product, basin and size of
+the synthetic input written by SyntheticORAIP. Each read runs in its
+own process with an empty CacheDir and goes through Products as in
+readProfiles and readTransects. The wall time, the bytes read and the
+peak memory are written to a json file.
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import resource
+import subprocess
+import multiprocessing
+from SyntheticORAIP import Sizes, generate
+import PORAIPHydrography
+from PORAIPHydrography import Products
+from PORAIPHydrography import CGLORS, ECDA, GECCO2, GloSea5, GLORYS2V4, MOVEG2, MOVEG2i
+from PORAIPHydrography import ORAP5, SODA331, TOPAZ, UoR, EN4, Sumata, WOA13
+
+# benchmarked products, TOPAZ and Sumata cover only the Arctic
+ProductObjs = [CGLORS,ECDA,GECCO2,GloSea5,GLORYS2V4,MOVEG2,MOVEG2i,\
+               ORAP5,SODA331,TOPAZ,UoR,EN4,Sumata,WOA13]
+ArcticOnly = ['TOPAZ','Sumata']
+
+def getIOCounters():
+    """ Bytes read by this process through read calls (rchar) and from
+        the storage (read_bytes), None where /proc/self/io is missing
+    """
+    counters = {'rchar':None,'read_bytes':None}
+    try:
+        fp = open('/proc/self/io')
+        for line in fp:
+            key, value = line.split(':')
+            if key in counters:
+                counters[key] = int(value)
+        fp.close()
+    except IOError:
+        pass
+    return counters
+
+def getMethod(pobj,mode):
+    """ Read method of product class pobj for mode profiles or transects
+    """
+    method = {'profiles':'readProfile','transects':'readTransect'}[mode]
+    if pobj is GECCO2:
+        method = method.replace('read','readGECCO2')
+    return method
+
+def getProduct(prset,pobj):
+    """ The product of class pobj in prset, the climatologies and EN4
+        are those that prset makes for itself
+    """
+    for name, cls in [('sumata',Sumata),('woa13',WOA13),('en4',EN4)]:
+        if pobj is cls:
+            return getattr(prset,name)
+    return prset.products[0]
+
+def runOne(args):
+    """ Read one product in a worker process, returns its timings
+    """
+    pobj, basin, mode, syr, eyr = args
+    io0 = getIOCounters()
+    t0 = time.time()
+    own = [] if pobj in [Sumata,WOA13,EN4] else [pobj]
+    prset = Products(own,basin,syr,eyr)
+    product = getProduct(prset,pobj)
+    prset.readProducts([product],[getMethod(pobj,mode)])
+    wall = time.time()-t0
+    io1 = getIOCounters()
+    result = {'product':pobj.__name__,'basin':basin,'mode':mode,\
+              'wall':wall,'maxrss_kb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,\
+              'bytes':sum([v['bytes'] for v in product.stats['vars'].values()])}
+    for key in io0:
+        if io0[key] is not None:
+            result[key] = io1[key]-io0[key]
+    return result
+
+def getRevision():
+    """ git revision of the readers, None outside a git checkout
+    """
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],\
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+class Benchmark(object):
+    """ Reads of products per basin, mode and size. The synthetic input
+        of each size is written under root unless it exists.
+        CacheDir (results, masks, time indices and the catalog) is
+        removed before each read.
+    """
+    def __init__(self,root,sizes=['small'],basins=['Arctic','Antarctic'],\
+                 modes=['profiles'],products=ProductObjs,syr=1993):
+        self.root = os.path.abspath(root)
+        self.sizes, self.basins, self.modes = sizes, basins, modes
+        self.products = products
+        self.syr = syr
+        self.results = []
+
+    def getRuns(self,size):
+        eyr = self.syr+Sizes[size]['nyears']-1
+        runs = []
+        for mode in self.modes:
+            basins = ['Fram Strait'] if mode=='transects' else self.basins
+            for basin in basins:
+                for pobj in self.products:
+                    if pobj.__name__ in ArcticOnly and basin in ['Antarctic']:
+                        continue
+                    if pobj is EN4 and mode=='transects':
+                        continue
+                    runs.append((pobj,basin,mode,self.syr,eyr))
+        return runs
+
+    def runSize(self,size):
+        datadir = os.path.join(self.root,size)
+        if not os.path.exists(datadir):
+            generate(datadir,size,self.syr)
+        cwd = os.getcwd()
+        os.chdir(datadir)
+        try:
+            for run in self.getRuns(size):
+                shutil.rmtree(PORAIPHydrography.CacheDir,ignore_errors=True)
+                # a fresh process per read for its own peak memory
+                pool = multiprocessing.Pool(1)
+                try:
+                    result = pool.apply(runOne,(run,))
+                finally:
+                    pool.close()
+                    pool.join()
+                result.update({'size':size,'syr':run[3],'eyr':run[4],'nz':Sizes[size]['nz']})
+                print "%(size)s %(mode)s %(basin)s %(product)s: %(wall).2f s, %(maxrss_kb)d kB" % result
+                self.results.append(result)
+        finally:
+            os.chdir(cwd)
+
+    def run(self):
+        for size in self.sizes:
+            self.runSize(size)
+
+    def save(self,fn):
+        report = {'date':time.strftime('%Y-%m-%dT%H:%M:%S'),\
+                  'revision':getRevision(),\
+                  'results':self.results}
+        fp = open(fn,'w')
+        json.dump(report,fp,indent=1,sort_keys=True)
+        fp.close()
+        print "Wrote %s" % fn
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('root',help='directory of the synthetic input')
+    parser.add_argument('--sizes',default='small',help='comma separated of %s' % ','.join(sorted(Sizes)))
+    parser.add_argument('--basins',default='Arctic,Antarctic')
+    parser.add_argument('--modes',default='profiles',help='profiles and/or transects')
+    parser.add_argument('--products',default=None,help='comma separated product classes, all by default')
+    parser.add_argument('--out',default='oraip-benchmark.json')
+    args = parser.parse_args()
+    products = ProductObjs
+    if args.products is not None:
+        products = [pobj for pobj in ProductObjs if pobj.__name__ in args.products.split(',')]
+    benchmark = Benchmark(args.root,args.sizes.split(','),args.basins.split(','),\
+                          args.modes.split(','),products)
+    benchmark.run()
+    benchmark.save(args.out)
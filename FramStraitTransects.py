@@ -2,30 +2,37 @@
 """
 Plot Polar ORA-IP annual mean transects (T and S)
 across the Fram Strait:
-    79N, -10E,20E
+    79N, 20.5W-10.5E
+The products are interpolated to the points of the section,
+see PORAIPHydrography.Sections, and plotted against the
+distance along it.
 """
 
-import sys, os, cPickle, gzip
+import sys, os
 
 import numpy as np
 import matplotlib.pyplot as plt
 import cmocean
 
-from PORAIPHydrography import Products, UoR, MultiModelMean, WOA13, Sumata
+from PORAIPHydrography import Products, UoR, MultiModelMean, WOA13, Sumata, loadProducts
+from PORAIPHydrography import getSectionPoints
 from PORAIPHydrography import GloSea5, MOVEG2i, GECCO2, EN4
 from PORAIPHydrography import ECDA, ORAP5, SODA331, TOPAZ, GLORYS2V4, CGLORS
 
 class Transect(object):
-    def __init__(self,products):
-        self.prset = prset
-        self.prset.readTransects()
+    def __init__(self,products,read=True):
+        """ products are read unless read is False, e.g. when they
+            come from a results store
+        """
+        self.prset = products
+        if read:
+            self.prset.readTransects()
         for vname in ['T','S']:
             self.prset.getMultiModelMean(vname)
 
-    def plotOnePanel(self,ax,product,vname,\
-                     lons=np.arange(-19,22),\
-                     xidx=np.hstack((np.arange(-19,0),np.arange(22)))):
+    def plotOnePanel(self,ax,product,vname):
         vari    = getattr(product,vname)
+        dist = getSectionPoints(self.prset.basin)[2]
         z = getattr(vari,'mz')
         if vname=='T':
             ccmap= cmocean.cm.thermal
@@ -36,7 +43,7 @@ class Transect(object):
             vmin, vmax = 32., 35.
         #    mmin, mmax = 32, 36.
         dtrans = getattr(vari,'data')
-        cnt = ax.pcolormesh(lons,z,dtrans[:,xidx],vmin=vmin,vmax=vmax,cmap=ccmap)
+        cnt = ax.pcolormesh(dist,z,dtrans,vmin=vmin,vmax=vmax,cmap=ccmap)
         ax.invert_yaxis()
         ax.set_title(product.dset)
         return cnt
@@ -48,10 +55,7 @@ class Transect(object):
         for pidx, objname in enumerate(['sumata','woa13','mmm']):
             product = getattr(self.prset,objname)
             ax = fig.add_subplot(nx,ny,pidx+1)
-            if objname in ['mmm']:
-                cnt = self.plotOnePanel(ax,product,vname)
-            else:
-                cnt = self.plotOnePanel(ax,product,vname,xidx=np.arange(160,201))
+            cnt = self.plotOnePanel(ax,product,vname)
         cax = fig.add_axes([0.92, 0.72, 0.02, 0.18])
         cb  = fig.colorbar(cnt,cax=cax)
         if vname=='T':
@@ -63,7 +67,7 @@ class Transect(object):
             cnt = self.plotOnePanel(ax,product,vname)
             if pidx==6:
                 ax.set_ylabel('depth [m]')
-                ax.set_xlabel('longitude [$^\circ$E]')
+                ax.set_xlabel('distance [km]')
         cax = fig.add_axes([0.16, 0.04, 0.7, 0.02])
         cb  = fig.colorbar(cnt,cax=cax,orientation='horizontal')
         if vname=='T':
@@ -74,20 +78,16 @@ class Transect(object):
         plt.savefig("fstransect_%s.png" % vname)
 
 if __name__ == "__main__":
-    prset = Products([UoR,GloSea5,MOVEG2i,GECCO2,EN4,\
-                      ECDA,ORAP5,GLORYS2V4,CGLORS,SODA331,TOPAZ],'Fram Strait')
-    #prset = Products([UoR],'Fram Strait')
-    fileout = "fstransect"
-    cpzfile = fileout+'.cpickle.gz'
-    if os.path.exists(cpzfile):
-        fp = gzip.open(cpzfile)
-        fstransect = cPickle.load(fp)
-        fp.close()
+    store = "fstransect.npz"
+    if '--plot-only' in sys.argv and os.path.exists(store):
+        fstransect = Transect(loadProducts(store),read=False)
     else:
+        prset = Products([UoR,GloSea5,MOVEG2i,GECCO2,EN4,\
+                          ECDA,ORAP5,GLORYS2V4,CGLORS,SODA331,TOPAZ],'Fram Strait')
+        #prset = Products([UoR],'Fram Strait')
+        # transects are cached per product, see Products.readProducts
         fstransect = Transect(prset)
-        fp = gzip.open(cpzfile,'w')
-        cPickle.dump(fstransect,fp)
-        fp.close()
+        fstransect.prset.saveStore(store)
     # plotting
     for vname in ['T','S']:
         fstransect.plotTransects(vname)
@@ -10,41 +10,78 @@ import sys
 sys.path.append('/home/uotilap/tiede/ORA-IP/annual_mean')
 import numpy as np
 import netCDF4 as nc
-from plotAnnuaMeanProfile import LevelBounds
+from plotAnnuaMeanProfile import LevelBounds, WOA13profile, getLayerMeans
 
 class Hiroshis(object):
-    def __init__(self,fn='./ts-clim/hiroshis-clim/archive_v12_QC2_3_DPL_checked_2d_season_int-remapbil-oraip.nc'):
+    """ The climatology file is opened on first use and only the
+        column of a point is read. With woapath the missing layers
+        of a point are filled from the WOA13 files in woapath.
+    """
+    def __init__(self,fn='./ts-clim/hiroshis-clim/archive_v12_QC2_3_DPL_checked_2d_season_int-remapbil-oraip.nc',\
+                 woapath=None):
         self.dset, self.syr, self.eyr = 'Sumata', 1980, 2015
-        fp = nc.Dataset(fn)
-        self.olon = np.array(fp.variables['lon'][:])
-        # transfer negative lons to positive
-        self.olon[np.where(self.olon<0.)] += 360.
-        self.olat = np.array(fp.variables['lat'][:])
-        self.odepth = np.array(fp.variables['depth'][:])
-        self.temperature = np.ma.array(fp.variables['temperature'][:])
-        self.salinity    = np.ma.array(fp.variables['salinity'][:])
-        fp.close()
+        self.fn = fn
+        self.woapath = woapath
+        self.ncname = {'T':'temperature',\
+                       'S':'salinity'}
+        self.fp = None
+        # seasonal means of the full fields, see getSeasonalMean
+        self.seasonalmeans = {}
+
+    def getDataset(self):
+        """ Dataset of fn, opened and its grid read on first use
+        """
+        if self.fp is None:
+            self.fp = nc.Dataset(self.fn)
+            self.olon = np.array(self.fp.variables['lon'][:])
+            # transfer negative lons to positive
+            self.olon[np.where(self.olon<0.)] += 360.
+            self.olat = np.array(self.fp.variables['lat'][:])
+            self.odepth = np.array(self.fp.variables['depth'][:])
+        return self.fp
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def readColumn(self,vname,iy,ix):
+        """ Seasons of the column (iy,ix) of vname, [season,depth]
+        """
+        ncvar = self.getDataset().variables[self.ncname[vname]]
+        return np.ma.array(ncvar[:,:,iy,ix])
+
+    def getSeasonalMean(self,vname):
+        """ Mean over the seasons of the full field of vname,
+            [depth,lat,lon], memoized
+        """
+        if vname not in self.seasonalmeans:
+            ncvar = self.getDataset().variables[self.ncname[vname]]
+            self.seasonalmeans[vname] = np.ma.average(np.ma.array(ncvar[:]),axis=0)
+        return self.seasonalmeans[vname]
 
     def getPoint(self,plon,plat,vname):
         """ get the closest point of (plon,plat)
         """
         self.vname, self.lon, self.lat = vname, plon, plat
-        iy = np.where(np.abs(plat-self.olat)==np.min(np.abs(plat-self.olat)))[0][0]
-        ix = np.where(np.abs(plon-self.olon)==np.min(np.abs(plon-self.olon)))[0][0]
+        self.getDataset()
+        iy = np.argmin(np.abs(plat-self.olat))
+        ix = np.argmin(np.abs(plon-self.olon))
         print "Looking for (%f,%f), closest at (%f,%f)" % \
               (plon,plat,self.olon[ix],self.olat[iy])
         depth = self.odepth
-        if vname=='S':
-            data, level_bounds = self.salinity, LevelBounds['S']
+        level_bounds = LevelBounds[vname]
+        if vname in self.seasonalmeans:
+            tavg_data = self.seasonalmeans[vname][:,iy,ix]
         else:
-            data, level_bounds = self.temperature, LevelBounds['T']
-        tavg_data = np.ma.average(data,axis=0)
+            tavg_data = np.ma.average(self.readColumn(vname,iy,ix),axis=0) # [depth]
         # vertical layer averaging
-        self.data = []
+        self.data = getLayerMeans(depth,tavg_data[:,np.newaxis],level_bounds)[:,0]
         for lb in level_bounds:
-            iz = np.where((depth>=lb[0])&(depth<lb[1]))
-            self.data.append(tavg_data[iz].mean())
             print "Averaged layer %d-%d" % (lb[0],lb[1])
+        if self.woapath is not None and np.ma.count_masked(self.data):
+            woa = WOA13profile(vname,plon,plat,path=self.woapath)
+            self.data = np.ma.where(np.ma.getmaskarray(self.data),woa.data,self.data)
         self.depth = np.hstack((level_bounds[:,0],4000))
         print "depth:", self.depth
 
@@ -52,6 +89,7 @@ if __name__ == "__main__":
     lon, lat = 98., 83.
     hrs = Hiroshis()
     hrs.getPoint(lon,lat,'T')
+    hrs.close()
     import matplotlib.pyplot as plt
     fig = plt.figure(figsize=(5,10))
     ax = fig.add_subplot(1,1,1)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Catalog of the netCDF files of an ORA-IP data directory.
+The directory is scanned once and the catalog is kept in a json
+file so that files are resolved without stat or glob calls.
+"""
+
+import os
+import sys
+import re
+import json
+import hashlib
+
+# directory of the catalogs persisting between runs
+CacheDir = './oraip-cache'
+# data roots tried when the requested path does not exist
+DataRoots = ['/lustre/tmp/uotilap/ORA-IP/annual_mean', # we are on voima
+             './'] # last resort is cwd
+# ORA-IP annual mean integrals, e.g.
+# UoR_intT_annmean_1989to2010_0-100m_r360x180.nc
+IntegralPattern = re.compile('^(.+)_int([TS])_annmean_(\d{4})to(\d{4})_(.+?)(_r360x180)?\.nc$')
+# data roots resolved in this process, see getDataPath
+DataPaths = {}
+# catalogs loaded in this process, see getCatalog
+Catalogs = {}
+
+def getDataPath(path):
+    """ path, or the first existing of DataRoots if path does not exist.
+        Resolved once per process.
+    """
+    if path not in DataPaths:
+        root = path
+        for droot in [path]+DataRoots:
+            if os.path.exists(droot):
+                root = droot
+                break
+        DataPaths[path] = os.path.abspath(root)
+    return DataPaths[path]
+
+def parseIntegralFilename(fn):
+    """ product, variable, start and end years and depth range (e.g. 0-100m,
+        0-bottom or full) of an ORA-IP integral file, None for other files
+    """
+    m = IntegralPattern.match(os.path.basename(fn))
+    if m is None:
+        return None
+    product, vname, syr, eyr, drange, grid = m.groups()
+    return {'product':product,'vname':vname,\
+            'syr':int(syr),'eyr':int(eyr),\
+            'drange':drange,'grid':(grid or '').lstrip('_'),\
+            'path':fn}
+
+class Catalog(object):
+    """ netCDF files below root with their mtime and size, and the ORA-IP
+        integral files by product, variable, depth range and years.
+        The catalog is rescanned if a directory with netCDF files has
+        changed, new directories and files rewritten in place need refresh().
+    """
+    def __init__(self,root,cachedir=None,refresh=False):
+        self.root = root
+        if cachedir is None:
+            cachedir = CacheDir
+        self.cachedir = os.path.abspath(cachedir)
+        self.fn = os.path.join(cachedir,'catalogs',\
+                               hashlib.md5(root).hexdigest()+'.json')
+        if refresh or not self.load():
+            self.refresh()
+
+    def scan(self):
+        """ Walk root once recording the netCDF files and the mtimes of
+            the directories containing them. CacheDir is skipped.
+        """
+        self.dirs, self.files = {}, {}
+        for dn, subdns, fns in os.walk(self.root,followlinks=True):
+            subdns[:] = [d for d in subdns if os.path.abspath(os.path.join(dn,d))!=self.cachedir]
+            rdn = os.path.relpath(dn,self.root)
+            fns = [fn for fn in fns if fn.endswith('.nc')]
+            if len(fns):
+                self.dirs[rdn] = os.path.getmtime(dn)
+            for fn in fns:
+                st = os.stat(os.path.join(dn,fn))
+                self.files[os.path.normpath(os.path.join(rdn,fn))] = (st.st_mtime,st.st_size)
+        self.setIntegrals()
+
+    def setIntegrals(self):
+        self.integrals = {}
+        for fn in sorted(self.files):
+            entry = parseIntegralFilename(fn)
+            if entry is not None:
+                key = (entry['product'],entry['vname'],entry['drange'])
+                self.integrals.setdefault(key,[]).append(entry)
+
+    def refresh(self):
+        """ Rescan root and save the catalog
+        """
+        print "Scanning %s" % self.root
+        self.scan()
+        self.save()
+
+    def save(self):
+        try:
+            dn = os.path.dirname(self.fn)
+            if not os.path.exists(dn):
+                os.makedirs(dn)
+            tmpfile = "%s.%d" % (self.fn,os.getpid())
+            fp = open(tmpfile,'w')
+            json.dump({'root':self.root,'dirs':self.dirs,'files':self.files},fp)
+            fp.close()
+            os.rename(tmpfile,self.fn)
+        except (IOError,OSError):
+            print "Cant write %s, keeping catalog in memory" % self.fn
+
+    def load(self):
+        """ Read the saved catalog. Returns False if there is none
+            or a directory with netCDF files has changed since the scan.
+        """
+        if not os.path.exists(self.fn):
+            return False
+        fp = open(self.fn)
+        catalog = json.load(fp)
+        fp.close()
+        for rdn, mtime in catalog['dirs'].items():
+            dn = os.path.join(self.root,rdn)
+            if not os.path.isdir(dn) or os.path.getmtime(dn)!=mtime:
+                return False
+        self.dirs = dict([(str(k),v) for k,v in catalog['dirs'].items()])
+        self.files = dict([(str(k),tuple(v)) for k,v in catalog['files'].items()])
+        self.setIntegrals()
+        return True
+
+    def getRelPath(self,fn):
+        """ fn relative to root, also if fn is a full path below root
+        """
+        if os.path.isabs(fn) and fn.startswith(os.path.join(self.root,'')):
+            fn = os.path.relpath(fn,self.root)
+        return os.path.normpath(fn)
+
+    def hasFile(self,fn):
+        return self.getRelPath(fn) in self.files
+
+    def getPath(self,fn):
+        """ Full path of fn relative to root, fn as is if it is
+            not in the catalog (e.g. an absolute path)
+        """
+        if self.hasFile(fn):
+            return os.path.join(self.root,self.getRelPath(fn))
+        return fn if os.path.isabs(fn) else os.path.join(self.root,fn)
+
+    def getFileKey(self,fn):
+        """ Full path, mtime and size of fn, the mtime and size are
+            None if fn is missing. They come from a stat of fn, not from
+            the catalog, as files rewritten in place are not rescanned.
+        """
+        path = self.getPath(fn)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return (path,None,None)
+        return (path,st.st_mtime,st.st_size)
+
+    def findIntegralFiles(self,product,vname,drange,grid='r360x180'):
+        """ Full paths of the integral files of product and variable vname
+            (T or S) over depth range drange, e.g. 0-100m
+        """
+        return [os.path.join(self.root,e['path']) for e in \
+                self.integrals.get((product,vname,drange),[]) if e['grid']==grid]
+
+def getCatalog(path,refresh=False,cachedir=None):
+    """ Catalog of the data root of path loaded once per process,
+        refresh rescans the data root
+    """
+    root = getDataPath(path)
+    if root not in Catalogs:
+        Catalogs[root] = Catalog(root,cachedir,refresh)
+    elif refresh:
+        Catalogs[root].refresh()
+    return Catalogs[root]
+
+if __name__ == "__main__":
+    # rescan the data roots given as arguments
+    for path in sys.argv[1:] or ['./']:
+        catalog = getCatalog(path,refresh=True)
+        print "%d files, %d integrals in %s" % \
+              (len(catalog.files),sum([len(v) for v in catalog.integrals.values()]),catalog.root)
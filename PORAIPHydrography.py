@@ -10,16 +10,348 @@ import re
 import copy
 import glob
 import string
-import cPickle
-import gzip
+import hashlib
+import inspect
+import csv
+import json
+import time
+import collections
+import multiprocessing
+import threading
+import resource
+import Queue
 import numpy as np
+from scipy import sparse
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
 import netCDF4 as nc
-from datetime import datetime
 from netcdftime import utime
 from seawater import dens0
+from ORAIPCatalog import getCatalog
+
+# directory of the caches persisting between runs
+CacheDir = './oraip-cache'
+# directory of the ORA-IP data, see ORAIPCatalog for the fallbacks
+DataPath = '/home/uotilap/tiede/ORA-IP/annual_mean/'
+# WOA13 landsea mask defining the bathymetry
+BathymetryFile = 'landsea_01.msk'
+# WOA13 bathymetries parsed in this process, see loadWOA13Bathymetry
+Bathymetries = {}
+# basin and field masks computed or loaded in this process, see loadMask
+Masks = {}
+# decoded time axes of the files read in this process, see loadTimeIndex
+TimeIndices = {}
+# pool of open netCDF datasets by file, least recently used first,
+# with their number of users, see openDataset
+Datasets = collections.OrderedDict()
+DatasetsLock = threading.Lock()
+# max number of datasets kept open when unused
+MaxOpenDatasets = 32
+# directory of the run reports of Products, see Products.writeReport
+ReportDir = './oraip-reports'
+# read statistics counted per product and variable, see Product.resetStats
+StatsCounters = ['files','reads','bytes','io','mask','reduce']
+# sigma-t grids of the TS diagrams by range and resolution, see calcDensityGrid
+DensityGrids = {}
+# transect sections by name. Their waypoints (lon E, lat N) are joined
+# by great circles sampled every SectionSpacing km, see getSectionPoints.
+# Fram Strait runs along 79N through the 1 deg cell centres 339.5E-10.5E.
+Sections = {'Fram Strait':[(lon,79.) for lon in np.arange(-20.5,11.,1.)],\
+            'Arctic transect':[(210.,70.),(0.,90.),(100.,70.)],\
+            'Bering Strait':[(190.5,65.8),(193.5,65.8)],\
+            'Barents opening':[(20.,70.3),(19.,74.5)]}
+SectionSpacing = 25. # km
+EarthRadius = 6371. # km
+# sampled points of the sections, see getSectionPoints
+SectionPoints = {}
+
+def saveArray(fn,data):
+    """ np.save data, or np.savez a dict of arrays, to fn. It is written
+        to a temporary file which is then renamed so that concurrent
+        processes never see a partial file. Returns False if fn could
+        not be written.
+    """
+    try:
+        dn = os.path.dirname(fn)
+        if dn and not os.path.exists(dn):
+            os.makedirs(dn)
+        tmpfile = "%s.%d.%d" % (fn,os.getpid(),threading.current_thread().ident)
+        fp = open(tmpfile,'wb')
+        if isinstance(data,dict):
+            np.savez(fp,**data)
+        else:
+            np.save(fp,data)
+        fp.close()
+        os.rename(tmpfile,fn)
+    except (IOError,OSError):
+        return False
+    return True
+
+def getFileKey(fn):
+    """ Absolute path, mtime and size of fn identifying its contents
+        in cache keys, the mtime and size are None if fn is missing
+    """
+    fn = os.path.abspath(fn)
+    if not os.path.exists(fn):
+        return (fn,None,None)
+    return (fn,os.path.getmtime(fn),os.path.getsize(fn))
+
+def getBathymetryKey(bathymetry):
+    """ Fingerprint of the values and mask of a bathymetry
+    """
+    return hashlib.md5(np.ma.filled(bathymetry,0).tostring()+\
+                       np.ma.getmaskarray(bathymetry).tostring()).hexdigest()
+
+def loadMask(key,calcMask):
+    """ Boolean mask memoized by key in memory and on disk in CacheDir,
+        calcMask() computes it when it is not found in either.
+    """
+    if key in Masks:
+        return Masks[key]
+    fn = os.path.join(CacheDir,'masks',hashlib.md5(repr(key)).hexdigest()+'.npy')
+    if os.path.exists(fn):
+        mask = np.load(fn)
+    else:
+        mask = np.array(calcMask(),dtype=bool)
+        saveArray(fn,mask)
+    mask.flags.writeable = False
+    Masks[key] = mask
+    return mask
+
+def loadWOA13Bathymetry(bfile):
+    """ Bottom depth [m] of the WOA13 landsea mask bfile as a read-only
+        (180,360) array shared by all products of the process.
+        The parsed depths are kept in a memory-mapped bfile.npy
+        which is rebuilt only when bfile changes.
+    """
+    key, mtime = os.path.abspath(bfile), os.path.getmtime(bfile)
+    if key in Bathymetries and Bathymetries[key][0]==mtime:
+        return Bathymetries[key][1]
+    npyfile = bfile+'.npy'
+    if os.path.exists(npyfile) and os.path.getmtime(npyfile)>=mtime:
+        b2d = np.load(npyfile,mmap_mode='r')
+    else:
+        depth = np.array(range(0,105,5)+range(125,525,25)+range(550,2050,50)+range(2100,9200,100))
+        dat = np.loadtxt(bfile,skiprows=2,delimiter=',',usecols=(2,))
+        b2d = np.reshape(depth[dat.astype(int)-1],(180,360))
+        if saveArray(npyfile,b2d):
+            b2d = np.load(npyfile,mmap_mode='r')
+        else:
+            print "Cant write %s, keeping bathymetry in memory" % npyfile
+            b2d.flags.writeable = False
+    Bathymetries[key] = (mtime,b2d)
+    return b2d
+
+def openDataset(fn):
+    """ netCDF Dataset of fn from the pool of open datasets, it is
+        opened only if it is not in the pool. Each openDataset must
+        be followed by releaseDataset.
+    """
+    with DatasetsLock:
+        if fn in Datasets:
+            fp, nusers = Datasets.pop(fn)
+        else:
+            fp, nusers = nc.Dataset(fn), 0
+            print "Reading %s" % fn
+        Datasets[fn] = [fp,nusers+1]
+        evictDatasets()
+    return fp
+
+def releaseDataset(fp):
+    """ Return fp to the pool, it is closed when it is evicted
+    """
+    with DatasetsLock:
+        for fn, entry in Datasets.items():
+            if entry[0] is fp:
+                entry[1] -= 1
+                break
+        else:
+            fp.close()
+        evictDatasets()
+
+def evictDatasets(maxopen=None):
+    """ Close the least recently used unused datasets
+        until at most maxopen (MaxOpenDatasets) are open
+    """
+    if maxopen is None:
+        maxopen = MaxOpenDatasets
+    unused = [fn for fn, entry in Datasets.items() if entry[1]<1]
+    for fn in unused[:max(len(Datasets)-maxopen,0)]:
+        Datasets.pop(fn)[0].close()
+
+def closeDatasets():
+    """ Close all datasets of the pool, e.g. before forking workers
+        which must not share the open files
+    """
+    with DatasetsLock:
+        for fn in Datasets.keys():
+            Datasets.pop(fn)[0].close()
+
+def calcDensityGrid(smin,smax,tmin,tmax,resolution=0.1):
+    """ Salinity and temperature axes covering [smin, smax] and
+        [tmin, tmax] at resolution and sigma-t [t,s] on them.
+        The range is widened to multiples of resolution so that close
+        ranges share a grid, grids are memoized in DensityGrids.
+    """
+    lo = np.floor(np.array([smin,tmin])/resolution).astype(int)
+    hi = np.ceil(np.array([smax,tmax])/resolution).astype(int)
+    key = (tuple(lo),tuple(hi),resolution)
+    if key not in DensityGrids:
+        si = np.arange(lo[0],hi[0]+1)*resolution
+        ti = np.arange(lo[1],hi[1]+1)*resolution
+        # one broadcast call over the grid, subtract 1000 to convert to sigma-t
+        dens = dens0(*np.meshgrid(si,ti)) - 1000
+        for a in [si,ti,dens]:
+            a.flags.writeable = False
+        DensityGrids[key] = (si,ti,dens)
+    return DensityGrids[key]
+
+def getSectionPoints(section):
+    """ lon, lat and distance [km] along section of its points, at most
+        SectionSpacing km apart on the great circles joining its waypoints.
+        The waypoints are points of the section. Memoized.
+    """
+    key = (section,repr(Sections[section]),SectionSpacing)
+    if key in SectionPoints:
+        return SectionPoints[key]
+    waypoints = np.deg2rad(np.array(Sections[section],dtype=float))
+    # unit vectors of the waypoints
+    xyz = np.array([np.cos(waypoints[:,1])*np.cos(waypoints[:,0]),\
+                    np.cos(waypoints[:,1])*np.sin(waypoints[:,0]),\
+                    np.sin(waypoints[:,1])]).T
+    lon, lat, dist = [waypoints[0,0]], [waypoints[0,1]], [0.]
+    for a, b, wb in zip(xyz[:-1],xyz[1:],waypoints[1:]):
+        angle = np.arccos(np.clip(np.dot(a,b),-1.,1.))
+        npnt = max(int(np.ceil(angle*EarthRadius/SectionSpacing)),1)
+        d0 = dist[-1]
+        for f in np.arange(1,npnt)/float(npnt):
+            p = (np.sin((1.-f)*angle)*a+np.sin(f*angle)*b)/np.sin(angle)
+            lon.append(np.arctan2(p[1],p[0]))
+            lat.append(np.arcsin(np.clip(p[2],-1.,1.)))
+            dist.append(d0+f*angle*EarthRadius)
+        lon.append(wb[0])
+        lat.append(wb[1])
+        dist.append(d0+angle*EarthRadius)
+    SectionPoints[key] = (np.mod(np.rad2deg(lon),360.),np.rad2deg(lat),np.array(dist))
+    return SectionPoints[key]
+
+def getInterpolationWeights(axis,points,period=None):
+    """ Indices [point,2] of the values of axis bracketing points and
+        their linear interpolation weights [point,2]. Points beyond the
+        ends of axis get its end values unless axis is periodic.
+        axis need not be sorted.
+    """
+    axis = np.asarray(axis,dtype=float)
+    order = np.argsort(axis)
+    saxis = axis[order]
+    points = np.asarray(points,dtype=float)
+    if period is not None:
+        saxis = np.hstack((saxis[-1]-period,saxis,saxis[0]+period))
+        order = np.hstack((order[-1],order,order[0]))
+        points = saxis[1]+np.mod(points-saxis[1],period)
+    i1 = np.clip(np.searchsorted(saxis,points),1,saxis.size-1)
+    i0 = i1-1
+    w1 = np.clip((points-saxis[i0])/(saxis[i1]-saxis[i0]),0.,1.)
+    return np.array([order[i0],order[i1]]).T, np.array([1.-w1,w1]).T
+
+def getCircularSlices(ix,nx):
+    """ Slices of a circular axis of size nx covering the indices ix,
+        the complement of the widest gap between them. Two slices
+        when they wrap across the axis edge.
+    """
+    gaps = np.diff(np.hstack((ix,ix[0]+nx)))
+    k = np.argmax(gaps)
+    if gaps[k]==1:
+        return [slice(0,nx)]
+    x0, x1 = ix[(k+1)%len(ix)], ix[k]+1
+    if x0<x1:
+        return [slice(x0,x1)]
+    return [slice(x0,nx),slice(0,x1)]
+
+def decodeTime(time):
+    """ Integer years and months of the records of the netCDF time
+        variable time, decoded with array arithmetic from its units
+        and calendar. Other calendars fall back to utime.
+    """
+    t = np.asarray(time[:],dtype=float)
+    m = re.match('\s*(\w+?)s?\s+since\s+(-?\d+)-(\d+)-(\d+)(?:[ T]+(\d+):(\d+):?([\d.]*))?',time.units)
+    calendar = getattr(time,'calendar','standard').lower()
+    unit = m.group(1).lower() if m else None
+    year0, month0, day0 = [int(s) for s in m.groups()[1:4]] if m else (0,1,1)
+    if unit=='month':
+        # months since, calendar is irrelevant
+        mi = month0-1+np.floor(t).astype(int)
+        return year0+mi//12, mi%12+1
+    secs = {'second':1.,'sec':1.,'minute':60.,'min':60.,\
+            'hour':3600.,'hr':3600.,'day':86400.}
+    if unit not in secs:
+        calendar = None
+    else:
+        h, mn, s = [float(v or 0) for v in m.groups()[4:7]]
+        days = t*secs[unit]/86400.+(h*3600.+mn*60.+s)/86400.
+    if calendar in ['standard','gregorian','proleptic_gregorian'] and \
+       (year0>1582 or calendar=='proleptic_gregorian'):
+        origin = np.datetime64('%04d-%02d-%02d' % (year0,month0,day0),'ms')
+        dates = origin+np.round(days*86400000.).astype('timedelta64[ms]')
+        return dates.astype('M8[Y]').astype(int)+1970, dates.astype('M8[M]').astype(int)%12+1
+    mdays = {'360_day':[30]*12,\
+             'noleap':[31,28,31,30,31,30,31,31,30,31,30,31],\
+             'all_leap':[31,29,31,30,31,30,31,31,30,31,30,31]}
+    mdays['365_day'], mdays['366_day'] = mdays['noleap'], mdays['all_leap']
+    if calendar in mdays:
+        cdays = np.cumsum([0]+mdays[calendar])
+        doy = np.floor(days+cdays[month0-1]+day0-1+1e-6).astype(int)
+        doy0 = doy%cdays[-1]
+        return year0+doy//cdays[-1], np.searchsorted(cdays,doy0,side='right')
+    # e.g. julian calendar
+    if hasattr(time,'calendar'):
+        cdftime = utime(time.units,calendar=time.calendar.lower())
+    else:
+        cdftime = utime(time.units)
+    dates = np.atleast_1d(cdftime.num2date(t))
+    return np.array([d.year for d in dates]), np.array([d.month for d in dates])
+
+def loadTimeIndex(key,time):
+    """ Years and months of the netCDF time variable time memoized
+        by key (file, mtime, size and variable name) in memory and on
+        disk in CacheDir, see decodeTime
+    """
+    if key in TimeIndices:
+        return TimeIndices[key]
+    fn = os.path.join(CacheDir,'times',hashlib.md5(repr(key)).hexdigest()+'.npz')
+    if os.path.exists(fn):
+        arrays = np.load(fn)
+        years, months = arrays['years'], arrays['months']
+    else:
+        years, months = decodeTime(time)
+        if key[1] is not None:
+            # files outside the catalog are decoded again in each process
+            saveArray(fn,{'years':years,'months':months})
+    TimeIndices[key] = (years, months)
+    return years, months
+
+def getProfVarArrays(pdata,prefix):
+    """ data and odata with their masks, and depth, of the profile
+        variable pdata as {prefix/name: array}
+    """
+    arrays = {}
+    for aname in ['data','odata']:
+        if hasattr(pdata,aname):
+            adata = getattr(pdata,aname)
+            arrays['%s/%s' % (prefix,aname)] = np.ma.getdata(adata)
+            arrays['%s/%smask' % (prefix,aname)] = np.ma.getmaskarray(adata)
+    if hasattr(pdata,'depth'):
+        arrays['%s/depth' % prefix] = pdata.depth
+    return arrays
+
+def getStoredArray(arrays,key):
+    """ Array key of the npz arrays written from getProfVarArrays,
+        masked if it has a mask
+    """
+    if key+'mask' in arrays.files:
+        return np.ma.array(arrays[key],mask=arrays[key+'mask'])
+    return arrays[key]
 
 class ProfVar(object):
     """ Temperature (T), salinity (S) or density (R) vertical
@@ -38,15 +370,139 @@ class ProfVar(object):
         # middle level depth
         self.mz = np.mean(level_bounds,axis=1)
 
+class StoredProfVar(ProfVar):
+    """ Profile variable of a results store, see Products.saveStore.
+        Its arrays are loaded from the store when first accessed.
+    """
+    def __init__(self,name,level_bounds,store,prefix):
+        super( StoredProfVar, self).__init__(name,level_bounds)
+        del self.data
+        self.store, self.prefix = store, prefix
+
+    def __getattr__(self,aname):
+        # called only for attributes which are not loaded yet
+        if aname in ['store','prefix'] or\
+           '%s/%s' % (self.prefix,aname) not in self.store.files:
+            raise AttributeError(aname)
+        value = getStoredArray(self.store,'%s/%s' % (self.prefix,aname))
+        setattr(self,aname,value)
+        return value
+
+def prefetch(reads,depth):
+    """ Iterate reads, a generator of slabs read from files, in a
+        background thread which reads up to depth slabs ahead while
+        the caller reduces the previous ones. All netCDF reads stay in
+        that one thread. With depth 0 reads is iterated in the caller.
+    """
+    if depth<1:
+        for item in reads:
+            yield item
+        return
+    queue, stop = Queue.Queue(depth), threading.Event()
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item,timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+    def run():
+        try:
+            for item in reads:
+                if not put((True,item)):
+                    break
+            else:
+                put((False,None))
+        except:
+            put((False,sys.exc_info()))
+        finally:
+            reads.close()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            ok, item = queue.get()
+            if ok:
+                yield item
+            elif item is None:
+                break
+            else:
+                raise item[0], item[1], item[2]
+    finally:
+        stop.set()
+        thread.join()
+
+class Accumulator(object):
+    """ Streaming masked mean, and optionally variance, of data added
+        piece by piece. Each piece is reduced over axis as it is added,
+        so only the sums are kept. The mean equals np.ma.mean over axis
+        of the concatenated pieces when axis includes the axis along
+        which they are concatenated.
+    """
+    def __init__(self,axis=0,variance=False):
+        self.axis = axis
+        self.variance = variance
+        self.wsum = self.wcnt = self.wsumsq = None
+
+    def add(self,data):
+        data  = np.ma.asarray(data)
+        valid = ~np.ma.getmaskarray(data)
+        fdata = np.ma.filled(data,0.)
+        if self.variance:
+            wsumsq = np.sum(np.square(fdata,dtype=float),axis=self.axis)
+        else:
+            wsumsq = None
+        self.addSums(np.sum(fdata,axis=self.axis,dtype=float),\
+                     np.sum(valid,axis=self.axis),wsumsq)
+
+    def addSums(self,wsum,wcnt,wsumsq=None):
+        """ Add already reduced (weighted) sums of the data and of the
+            weights of its valid values
+        """
+        if self.wsum is None:
+            self.wsum = np.array(wsum,dtype=float)
+            self.wcnt = np.array(wcnt,dtype=float)
+            if self.variance:
+                self.wsumsq = np.array(wsumsq,dtype=float)
+        else:
+            self.wsum += wsum
+            self.wcnt += wcnt
+            if self.variance:
+                self.wsumsq += wsumsq
+
+    def getMean(self):
+        if self.wsum is None:
+            return np.ma.masked
+        return np.ma.divide(self.wsum,np.ma.masked_equal(self.wcnt,0))
+
+    def getVariance(self):
+        if self.wsumsq is None:
+            return np.ma.masked
+        return np.ma.divide(self.wsumsq,np.ma.masked_equal(self.wcnt,0))-\
+               self.getMean()**2
+
+# module level code the read results depend on, see Product.getCodeKey
+ReaderCode = [loadMask,loadWOA13Bathymetry,calcDensityGrid,getSectionPoints,\
+              getInterpolationWeights,getCircularSlices,decodeTime,loadTimeIndex,\
+              prefetch,ProfVar,Accumulator]
+
 class Product(object):
     """ ORAIP annual means of T and S for the basin-average profile.
+        basin can also be a list of basins which are then all reduced
+        from the same reads, the first one being the primary basin.
     """
     def __init__(self,basin='Antarctic',\
                  syr=1993,eyr=2010,\
-                 path='/home/uotilap/tiede/ORA-IP/annual_mean/',\
+                 path=DataPath,\
                  level_bounds=None):
         self.path = path
-        self.basin = basin
+        if isinstance(basin,list):
+            self.basins = basin
+        else:
+            self.basins = [basin]
+        self.basin = self.basins[0]
         self.syr, self.eyr = syr, eyr
         self.LevelBounds = {}
         if level_bounds is None:
@@ -58,7 +514,44 @@ class Product(object):
                                               [1500,3000]])
         else:
             self.LevelBounds = level_bounds
-        self.bathymetry = self.readWOA13Bathymetry()
+        self.bathymetries = dict([(b,self.getBasinBathymetry(b)) for b in self.basins])
+        self.bathymetry = self.bathymetries[self.basin]
+        # fingerprints of the bathymetries for the mask keys, see getFieldMask
+        self.bathykeys = dict([(b,getBathymetryKey(self.bathymetries[b])) for b in self.basins])
+        # basin index windows per grid, see getBasinWindow
+        self.basinwindows = {}
+        # basin averaging operators per grid, see getBasinOperator
+        self.basinoperators = {}
+        # section interpolation operators per grid, see getSectionOperator
+        self.sectionoperators = {}
+        # layer averaging operators per depth axis, see getLayerOperator
+        self.layeroperators = {}
+        # keys of the files read by this product, see getInputFileKey
+        self.filekeys = {}
+        # max number of time records per slab read, and number of years
+        # per block in which the annual integral products are streamed
+        self.tchunk = 12
+        # number of slabs read ahead by the many-file products, 0 reads
+        # in turn with the reductions, see prefetch
+        self.prefetchdepth = 2
+        # files, reads and timings of the last read, see resetStats
+        self.resetStats()
+        # T and S profile variables of each basin
+        self.profvars = {}
+        for b in self.basins:
+            self.profvars[b] = dict([(vname,ProfVar(vname,self.LevelBounds[vname]))\
+                                     for vname in ['T','S']])
+        for vname in ['T','S']:
+            setattr(self,vname,self.profvars[self.basin][vname])
+        self.nclatname, self.nclonname    = 'lat', 'lon'
+        self.nctimename, self.ncdepthname = 'time', 'depth'
+        self.linestyle = '-'
+        self.lw = 3
+        self.lettercolor = 'white'
+        self.edgecolor = 'black'
+
+    def getBasinBathymetry(self,basin):
+        bathymetry = self.readWOA13Bathymetry()
         if basin in ['Arctic,','Eurasian','Amerasian']:
             mindpth = 500
         elif basin in ['Antarctic']:
@@ -67,37 +560,201 @@ class Product(object):
             mindpth = 0
         """ data in shallower than mindpth are excluded
         """
-        ib = np.where(self.bathymetry<mindpth)
-        self.bathymetry[ib] = 0.
+        ib = np.where(bathymetry<mindpth)
+        bathymetry[ib] = 0.
+        return bathymetry
+
+    def getProfVar(self,varname,basin=None):
+        """ Profile variable of varname (T or S) of basin,
+            the primary basin by default
+        """
+        if basin is None:
+            basin = self.basin
+        return self.profvars[basin][varname]
+
+    def setProfVars(self,profvars):
+        """ Replace the profile variables of all basins,
+            e.g. by those read in a worker process
+        """
+        self.profvars = profvars
         for vname in ['T','S']:
-            setattr(self,vname,ProfVar(vname,self.LevelBounds[vname]))
-        self.nclatname, self.nclonname    = 'lat', 'lon'
-        self.nctimename, self.ncdepthname = 'time', 'depth'
-        self.linestyle = '-'
-        self.lw = 3
-        self.lettercolor = 'white'
-        self.edgecolor = 'black'
+            setattr(self,vname,self.profvars[self.basin][vname])
+
+    def selectBasin(self,basin):
+        """ Shallow copy of the product with basin as its only basin.
+            Profile variables are shared with this product.
+        """
+        product = copy.copy(self)
+        product.basin = basin
+        product.basins = [basin]
+        product.profvars = {basin:self.profvars[basin]}
+        # products of a results store have no bathymetry
+        product.bathymetries = dict([(b,self.bathymetries[b]) for b in self.bathymetries if b==basin])
+        product.bathymetry = product.bathymetries.get(basin)
+        product.bathykeys = dict([(b,self.bathykeys[b]) for b in self.bathykeys if b==basin])
+        product.basinwindows = {}
+        product.basinoperators = {}
+        for vname in ['T','S']:
+            setattr(product,vname,self.profvars[basin][vname])
+        return product
 
     def getNetCDFfilename(self,varname,ulb,llb):
         return self.fpat % (varname,self.dsyr,self.deyr,ulb,llb)
 
-    def getNetCDFfilepointer(self,fn,path=None):
+    def getCatalog(self,path=None):
+        """ Catalog of the data files in path, self.path by default,
+            or in the fallback data roots if path does not exist
+        """
         if path is None:
             path = self.path
-        if not os.path.exists(path):
-            # we are on voima
-            path = '/lustre/tmp/uotilap/ORA-IP/annual_mean'
-        if not os.path.exists(path):
-            # last resort is cwd
-            path = './'
+        return getCatalog(path,cachedir=CacheDir)
+
+    def getNetCDFfilepointer(self,fn,path=None):
+        """ Open dataset of fn from the pool, see openDataset.
+            Give it back with closeNetCDFfilepointer.
+        """
+        fn = self.getCatalog(path).getPath(fn)
         try:
-           fp = nc.Dataset(os.path.join(path,fn))
-           print "Reading %s" % os.path.join(path,fn)
+           fp = openDataset(fn)
         except:
-           print "Cant read %s!" % os.path.join(path,fn)
+           print "Cant read %s!" % fn
            sys.exit(0)
         return fp
 
+    def closeNetCDFfilepointer(self,fp):
+        releaseDataset(fp)
+
+    def getInputFiles(self):
+        """ Names of the files read for the T and S profiles
+        """
+        fns = []
+        for varname in ['S','T']:
+            for dpth in np.unique(self.LevelBounds[varname]):
+                if dpth!=0.:
+                    fns.append(self.getNetCDFfilename(varname,0,dpth))
+        return fns
+
+    def getInputFileKey(self,fn):
+        """ Full path, mtime and size of the input file fn, see
+            Catalog.getFileKey. fn is stat'ed once per read of the
+            product, see Products.readProducts.
+        """
+        catalog = self.getCatalog()
+        path = catalog.getPath(fn)
+        if path not in self.filekeys:
+            self.filekeys[path] = catalog.getFileKey(fn)
+        return self.filekeys[path]
+
+    def getResultKey(self,method,basin):
+        """ Key of the result of method (readProfile etc.) for basin.
+            It changes with the product, years, level bounds, input files,
+            bathymetry and the reader code, see getCodeKey.
+        """
+        files = [self.getInputFileKey(fn) for fn in self.getInputFiles()]
+        levels = [(varname,np.asarray(self.LevelBounds[varname]).tolist()) for varname in ['S','T']]
+        return (self.__class__.__name__,method,basin,self.syr,self.eyr,levels,\
+                files,getFileKey(BathymetryFile),self.getBasinDefinitionKey(),self.getCodeKey())
+
+    def getCodeKey(self):
+        """ Fingerprint of the reader code of the product: its class and
+            base classes and the module level ReaderCode, so that editing
+            another product or the plotting keeps the cached results
+        """
+        classes = [cls for cls in inspect.getmro(self.__class__) if cls is not object]
+        return hashlib.md5(''.join([inspect.getsource(obj) for obj in classes+ReaderCode])).hexdigest()
+
+    def getResultFile(self,method,basin):
+        key = self.getResultKey(method,basin)
+        return os.path.join(CacheDir,'results',hashlib.md5(repr(key)).hexdigest()+'.npz')
+
+    def saveResults(self,method):
+        """ Store the T and S profile variables of each basin read by method
+            in CacheDir
+        """
+        for basin in self.basins:
+            arrays = {}
+            for vname in ['T','S']:
+                arrays.update(getProfVarArrays(self.getProfVar(vname,basin),vname))
+            saveArray(self.getResultFile(method,basin),arrays)
+
+    def loadResults(self,method):
+        """ Restore the T and S profile variables of each basin read by
+            method from CacheDir. Returns False unless all were found.
+        """
+        fns = [self.getResultFile(method,basin) for basin in self.basins]
+        if not all([os.path.exists(fn) for fn in fns]):
+            return False
+        for basin, fn in zip(self.basins,fns):
+            arrays = np.load(fn)
+            for vname in ['T','S']:
+                pdata = self.getProfVar(vname,basin)
+                for aname in ['data','odata','depth']:
+                    if '%s/%s' % (vname,aname) in arrays.files:
+                        setattr(pdata,aname,getStoredArray(arrays,'%s/%s' % (vname,aname)))
+        print "Using cached %s of %s" % (method,self.dset)
+        return True
+
+    def resetStats(self,method=None):
+        """ Clear the read statistics. The counters of StatsCounters
+            are kept per variable (T, S) in stats['vars']: the files
+            and the number of netCDF read calls and bytes read, and the
+            seconds spent reading, masking and reducing. files is the
+            set of files read.
+        """
+        self.stats = {'method':method,'cached':False,'wall':0.,'maxrss_kb':None,\
+                      'vars':dict([(vname,dict([(c,0) for c in StatsCounters]))\
+                                   for vname in ['T','S']])}
+        for vname in ['T','S']:
+            self.stats['vars'][vname]['files'] = set()
+
+    def addStats(self,varname,counter,value):
+        """ Add value to counter of varname, varname None is not counted
+        """
+        if varname is not None:
+            self.stats['vars'][varname][counter] += value
+
+    def getStatsVarName(self,ncvarname):
+        """ T or S of the netCDF variable ncvarname, None if it is neither
+        """
+        for varname in ['T','S']:
+            pattern = re.escape(self.ncvarname[varname]).replace('\\%d','\\d+')
+            if re.match(pattern,ncvarname):
+                return varname
+        return None
+
+    def readVar(self,ncvar,index):
+        """ ncvar[index] counted in the read statistics of its variable
+        """
+        t0 = time.time()
+        data = ncvar[index]
+        varname = self.getStatsVarName(ncvar.name)
+        if varname is not None:
+            self.addStats(varname,'io',time.time()-t0)
+            self.addStats(varname,'reads',1)
+            self.addStats(varname,'bytes',data.nbytes)
+            self.stats['vars'][varname]['files'].add(ncvar.group().filepath())
+        return data
+
+    def maskFillValue(self,varname,data,FillValue):
+        """ data masked where it is FillValue, if there is one
+        """
+        if FillValue is None:
+            return data
+        t0 = time.time()
+        data = np.ma.masked_values(data,FillValue)
+        self.addStats(varname,'mask',time.time()-t0)
+        return data
+
+    def readWithStats(self,method):
+        """ Call the read method with fresh read statistics and add
+            its wall time and the peak RSS of the process to them
+        """
+        self.resetStats(method)
+        t0 = time.time()
+        getattr(self,method)()
+        self.stats['wall'] = time.time()-t0
+        self.stats['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
     def getFillValue(self,ncvar):
         if hasattr(ncvar,'_FillValue'):
             FillValue = ncvar._FillValue
@@ -107,63 +764,265 @@ class Product(object):
             FillValue = None
         return FillValue
 
+    def getCumulativeNcVarName(self,varname,dpth):
+        """ netCDF variable name of the 0-dpth m integral of varname
+        """
+        return self.ncvarname[varname]
+
+    def getYearChunks(self):
+        """ [syr, eyr] split into blocks of at most tchunk years
+        """
+        return [(year,min(year+self.tchunk-1,self.eyr))\
+                for year in range(self.syr,self.eyr+1,self.tchunk)]
+
+    def iterCumulativeFields(self,varname):
+        """ Generate the distinct 0-Xm integrals of varname, {X: [t,y,x]}
+            and the grid, per block of years. Each file is opened once.
+        """
+        fps = {}
+        for dpth in np.unique(self.LevelBounds[varname]):
+            if dpth==0.:
+                continue
+            fps[dpth] = self.getNetCDFfilepointer(self.getNetCDFfilename(varname,0,dpth))
+        try:
+            for years in self.getYearChunks():
+                cumdata = {}
+                for dpth, fp in fps.items():
+                    cumdata[dpth], lon, lat = self.readOneFile(fp,\
+                                    self.getCumulativeNcVarName(varname,dpth),years)
+                if min([len(data) for data in cumdata.values()]):
+                    yield cumdata, lon, lat
+        finally:
+            for fp in fps.values():
+                self.closeNetCDFfilepointer(fp)
+
+    def getCumulativeLayers(self,varname,cumdata):
+        """ Layers [z,t,y,x] of varname from the cumulative 0-Xm integrals
+            {X: [t,y,x]} as their differences, all layers at once
+        """
+        level_bounds = self.LevelBounds[varname]
+        dpths = sorted(cumdata)
+        shape = np.shape(cumdata[dpths[0]])
+        dtype = np.ma.asarray(cumdata[dpths[0]]).dtype
+        # the 0-0m integral first, then the integrals by depth
+        cum = np.ma.concatenate([np.ma.zeros((1,)+shape,dtype=dtype)]+\
+                                [np.ma.asarray(cumdata[dpth])[np.newaxis] for dpth in dpths])
+        lidx = np.searchsorted(dpths,level_bounds[:,1])+1
+        uidx = np.where(level_bounds[:,0]==0.,0,np.searchsorted(dpths,level_bounds[:,0])+1)
+        thickness = (level_bounds[:,1]-level_bounds[:,0]).astype(cum.dtype)
+        # variable values from level averages
+        return (cum[lidx]-cum[uidx])/thickness[:,np.newaxis,np.newaxis,np.newaxis] # [z,t,y,x]
+
+    def iterVarProfile(self,varname):
+        """ varname is either T or S
+            Generate the layers [z,t,y,x] and the grid per block of years.
+            They are not masked by basin yet, see maskBasin.
+        """
+        for cumdata, lon, lat in self.iterCumulativeFields(varname):
+            yield self.getCumulativeLayers(varname,cumdata), lon, lat
+
     def readVarProfile(self,varname):
         """ varname is either T or S
+            Layers [z,t,y,x] of the whole year range and the grid
         """
-        data = []
-        for li, lb in enumerate(self.LevelBounds[varname]):
-            fn    = self.getNetCDFfilename(varname,0,lb[1])
-            ldata = self.readOneFile(fn,self.ncvarname[varname],lb[1])
-            if lb[0]==0.:
-                udata = 0.0*ldata
-            else:
-                fn    = self.getNetCDFfilename(varname,0,lb[0])
-                udata = self.readOneFile(fn,self.ncvarname[varname],lb[0])
-            data.append((ldata - udata)/(lb[1] - lb[0])) # [t,y,x] variable values from level averages
-        return np.ma.array(data) # [z,t,y,x]
+        data, lon, lat = zip(*self.iterVarProfile(varname))
+        return np.ma.concatenate(data,axis=1), lon[0], lat[0]
+
+    def maskBasin(self,varname,data,lon,lat,basin):
+        """ Copy of layers data [z,t,y,x] masked outside basin and where
+            the bottom is above the layer. The lower layer bound suffices
+            as the bathymetry mask of the upper one is within it.
+        """
+        t0 = time.time()
+        fldmask = np.array([self.getFieldMask(lon,lat,lb[1],basin)\
+                            for lb in self.LevelBounds[varname]])
+        fldmask = np.broadcast_to(fldmask[:,np.newaxis],data.shape)
+        data = np.ma.array(data,mask=fldmask,copy=True)
+        self.addStats(varname,'mask',time.time()-t0)
+        return data
 
     def maskBadSalinity(self,data):
         # get rid of bad mdata values
         # basically if S in the lower layer is smaller than in the upper one,
         # mask it.
+        t0 = time.time()
         for z in range(1,data['S'].shape[0]):
             zmask = np.ma.make_mask(data['S'][z]<data['S'][z-1])
             for varname in ['S','T']:
                 zdata = data[varname][z]
                 dmask = np.ma.mask_or(zdata.mask,zmask)
                 data[varname][z] = np.ma.array(zdata,mask=dmask)
+        self.addStats('S','mask',time.time()-t0)
         return data
 
-    def averageBasinAndTime(self,data):
-        """ data needs to be [z,t,y,x]
+    def averageBasinAndTime(self,data,grids,accumulators):
+        """ data needs to be [z,t,y,x] on grids {T,S: (lon,lat)}
+            Adds area weighted time and basin sums of each basin where
+            the bottom is below the layer to accumulators.
         """
         for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            pdata.data = np.ma.mean(data[varname],\
-                         axis=tuple(range(1,data[varname].ndim))) # time and basin average
+            t0 = time.time()
+            lon, lat = grids[varname]
+            wsum, wcnt = [], []
+            for z, lb in enumerate(self.LevelBounds[varname]):
+                operator = self.getBasinOperator(lon,lat,lb[1])
+                zsum, zcnt = self.sumBasins(operator,data[varname][z]) # [basin,t]
+                wsum.append(np.sum(zsum,axis=1))
+                wcnt.append(np.sum(zcnt,axis=1))
+            wsum, wcnt = np.array(wsum), np.array(wcnt) # [z,basin]
+            for bi, basin in enumerate(self.basins):
+                accumulators[basin][varname].addSums(wsum[:,bi],wcnt[:,bi])
+            self.addStats(varname,'reduce',time.time()-t0)
+
+    def reduceBasins(self,data,grids,accumulators,maxis=None):
+        """ Mask the layers data {T,S: [z,t,y,x]} on grids {T,S: (lon,lat)}
+            by each basin and add them to accumulators, averaged over time
+            and basin by default or according to maxis for transects.
+        """
+        if maxis is None:
+            # bad salinity masking is elementwise and the basin masks
+            # deepen with the layers, so it can be done before them
+            data = self.maskBadSalinity(data)
+            self.averageBasinAndTime(data,grids,accumulators)
+            return
+        for basin in self.basins:
+            bdata = {}
+            for varname in ['S','T']:
+                lon, lat = grids[varname]
+                bdata[varname] = self.maskBasin(varname,data[varname],lon,lat,basin)
+            bdata = self.maskBadSalinity(bdata)
+            for varname in ['S','T']:
+                t0 = time.time()
+                if basin in Sections:
+                    lon, lat = grids[varname]
+                    bdata[varname] = self.interpolateSection(bdata[varname],lon,lat,basin)
+                accumulators[basin][varname].add(bdata[varname])
+                self.addStats(varname,'reduce',time.time()-t0)
+
+    def getAccumulators(self,axis=0):
+        """ Accumulators of T and S of each basin, {basin: {T,S: Accumulator}}
+        """
+        return dict([(basin,dict([(varname,Accumulator(axis)) for varname in ['S','T']]))\
+                     for basin in self.basins])
+
+    def setAccumulatedData(self,accumulators):
+        """ Means of accumulators to the profile variables of each basin
+        """
+        for basin in self.basins:
+            for varname in ['S','T']:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = accumulators[basin][varname].getMean()
+
+    def reduceVarProfiles(self,sprofiles,tprofiles,maxis=None):
+        """ Reduce the S and T layers generated by sprofiles and tprofiles,
+            see iterVarProfile, block by block
+        """
+        # average according to maxis (leaving transect)
+        # maxis = (1,2) would be a time-average of a meridional transect
+        accumulators = self.getAccumulators(maxis)
+        for (sdata,slon,slat), (tdata,tlon,tlat) in zip(sprofiles,tprofiles):
+            data  = {'S':sdata,'T':tdata} # [z,t,y,x]
+            grids = {'S':(slon,slat),'T':(tlon,tlat)}
+            self.reduceBasins(data,grids,accumulators,maxis)
+        self.setAccumulatedData(accumulators)
 
     def readProfile(self):
         """ varname is either T or S
         """
-        data = {'T':[],'S':[]} # [z,t,y,x]
-        for varname in ['S','T']:
-            data[varname] = self.readVarProfile(varname)
-        data = self.maskBadSalinity(data)
-        self.averageBasinAndTime(data)
+        self.reduceVarProfiles(self.iterVarProfile('S'),self.iterVarProfile('T'))
 
     def readTransect(self,maxis=(1,2)):
         """ varname is either T or S
         """
-        data = {'T':[],'S':[]} # [z,t,y,x]
-        for varname in ['S','T']:
-            data[varname] = self.readVarProfile(varname)
-        data = self.maskBadSalinity(data)
-        # average according to maxis (leaving transect)
-        # maxis = (1,2) would be a time-average of a meridional transect
-        for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            pdata.data = np.ma.mean(data[varname],\
-                         axis=maxis) # time and basin average
+        self.reduceVarProfiles(self.iterVarProfile('S'),self.iterVarProfile('T'),maxis)
+
+    def getAreaWeights(self,lon,lat):
+        """ Grid cell area weights [y,x] of a regular lon/lat grid
+        """
+        return np.outer(np.cos(np.deg2rad(lat)),np.ones(lon.size))
+
+    def getBasinOperator(self,lon,lat,maxdpth=None):
+        """ Sparse [basin,y*x] matrix of the area weights of the grid cells
+            in each basin. With maxdpth the cells whose bottom is above
+            maxdpth are excluded. Memoized per grid and maxdpth.
+        """
+        key = (self.getGridKey(lon,lat),maxdpth)
+        if key in self.basinoperators:
+            return self.basinoperators[key]
+        weights = self.getAreaWeights(lon,lat).ravel()
+        rows, cols = [], []
+        for bi, basin in enumerate(self.basins):
+            if maxdpth is None:
+                outside = np.ma.getmaskarray(self.findBasinIndex(lon,lat,basin))
+            else:
+                outside = self.getFieldMask(lon,lat,maxdpth,basin)
+            icol = np.where(~outside.ravel())[0]
+            rows.append(bi*np.ones(icol.size,dtype=int))
+            cols.append(icol)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        operator = sparse.csr_matrix((weights[cols],(rows,cols)),\
+                                     shape=(len(self.basins),weights.size))
+        self.basinoperators[key] = operator
+        return operator
+
+    def getSectionOperator(self,lon,lat,section):
+        """ Sparse [point,y*x] matrix of the bilinear interpolation
+            weights of the points of section on the grid. Memoized per grid.
+        """
+        key = (section,self.getGridKey(lon,lat))
+        if key in self.sectionoperators:
+            return self.sectionoperators[key]
+        plon, plat = getSectionPoints(section)[:2]
+        iy, wy = getInterpolationWeights(lat,plat)
+        ix, wx = getInterpolationWeights(lon,plon,360.)
+        rows = np.repeat(np.arange(plon.size),4)
+        cols = (iy[:,:,np.newaxis]*lon.size+ix[:,np.newaxis,:]).ravel()
+        weights = (wy[:,:,np.newaxis]*wx[:,np.newaxis,:]).ravel()
+        operator = sparse.csr_matrix((weights,(rows,cols)),shape=(plon.size,lat.size*lon.size))
+        operator.eliminate_zeros()
+        self.sectionoperators[key] = operator
+        return operator
+
+    def interpolateSection(self,data,lon,lat,section):
+        """ data [...,y,x] interpolated to the points of section as
+            [...,1,point]. Masked values are left out of the weights,
+            a point is masked if all the cells around it are.
+        """
+        wsum, wcnt = self.sumBasins(self.getSectionOperator(lon,lat,section),data)
+        sdata = np.ma.divide(wsum,np.ma.masked_equal(wcnt,0)) # [point,...]
+        sdata = np.ma.transpose(sdata,range(1,sdata.ndim)+[0])
+        return sdata[...,np.newaxis,:]
+
+    def selectTransect(self,data,lon,lat,basin):
+        """ data [...,y,x] along the transect of basin: interpolated to
+            the points of a section of Sections as [...,1,point], otherwise
+            masked outside basin. The lat axis is then averaged out.
+        """
+        if basin in Sections:
+            return self.interpolateSection(data,lon,lat,basin)
+        return data*self.findBasinIndex(lon,lat,basin)
+
+    def sumBasins(self,operator,data):
+        """ Weighted sums of data [...,y,x] and of the weights of its
+            valid values over each basin of operator, [basin,...] each
+        """
+        shape = data.shape[:-2]
+        data = np.ma.reshape(data,(-1,data.shape[-2]*data.shape[-1]))
+        wsum = operator.dot(np.ma.filled(data,0.).T)
+        wcnt = operator.dot((~np.ma.getmaskarray(data)).T.astype(float))
+        return np.reshape(wsum,(-1,)+shape), np.reshape(wcnt,(-1,)+shape)
+
+    def averageBasins(self,data,lon,lat,varname=None):
+        """ Area weighted average of data [...,y,x] over each basin,
+            returns {basin: [...]}. Timed as reduction of varname.
+        """
+        t0 = time.time()
+        wsum, wcnt = self.sumBasins(self.getBasinOperator(lon,lat),data)
+        data_ba = {}
+        for bi, basin in enumerate(self.basins):
+            data_ba[basin] = np.ma.divide(wsum[bi],np.ma.masked_equal(wcnt[bi],0))
+        self.addStats(varname,'reduce',time.time()-t0)
+        return data_ba
 
     def readLatLon(self,fp):
         lat = np.array(fp.variables[self.nclatname][:])
@@ -172,26 +1031,69 @@ class Product(object):
         lon[np.where(lon<0.)] += 360.
         return lon, lat
 
-    def getDates(self,fp):
-        time = fp.variables[self.nctimename]
-        if hasattr(time,'calendar'):
-            cdftime = utime(time.units,calendar=time.calendar.lower())
-        else:
-            cdftime = utime(time.units)
-        return [cdftime.num2date(t) for t in time[:]]
+    def getTimeVariable(self,fp):
+        if fp.variables.has_key(self.nctimename):
+            return fp.variables[self.nctimename]
+        return fp.variables[self.nctimename.upper()]
+
+    def getTimeIndex(self,fp):
+        """ Integer years and months of the records of fp decoded
+            once per file and mtime, see loadTimeIndex
+        """
+        time = self.getTimeVariable(fp)
+        key = self.getInputFileKey(fp.filepath())+(time._name,)
+        return loadTimeIndex(key,time)
+
+    def getYears(self,fp):
+        return self.getTimeIndex(fp)[0]
 
     def findClosestLocation(self,lon,lat):
         ix = np.where(np.abs(lon-self.plon)==np.min(np.abs(lon-self.plon)))[0][0]
         iy = np.where(np.abs(lat-self.plat)==np.min(np.abs(lat-self.plat)))[0][0]
         return ix, iy
 
-    def findBasinIndex(self, lon, lat):
+    def findBasinIndex(self, lon, lat, basin=None):
+        """ Basin mask memoized by basin and grid, see calcBasinIndex
+        """
+        if basin is None:
+            basin = self.basin
+        key = ('basin',basin,self.getGridKey(lon,lat),self.getBasinDefinitionKey())
+        outside = loadMask(key,lambda: np.ma.getmaskarray(self.calcBasinIndex(lon,lat,basin)))
+        return np.ma.array(np.ones(outside.shape),mask=outside)
+
+    def getFieldMask(self,lon,lat,maxdpth,basin=None):
+        """ Combined basin and bathymetry mask memoized by basin, grid,
+            bathymetry and maxdpth. Regions shallower than maxdpth are
+            masked as their depth integrals are too small.
+        """
+        if basin is None:
+            basin = self.basin
+        basinmask = self.findBasinIndex(lon,lat,basin)
+        bathymetry = self.bathymetries[basin]
+        key = ('field',basin,self.getGridKey(lon,lat),self.getBasinDefinitionKey(),\
+               self.bathykeys[basin],float(maxdpth))
+        return loadMask(key,lambda: np.logical_or(np.ma.getmaskarray(basinmask),\
+                        np.ma.make_mask(bathymetry<maxdpth,shrink=False)))
+
+    def getBasinDefinitionKey(self):
+        """ Fingerprint of the basin definitions so that masks cached
+            on disk are recomputed when the definitions change
+        """
+        return hashlib.md5(inspect.getsource(self.calcBasinIndex)+\
+                           repr(sorted(Sections.items()))+repr(SectionSpacing)).hexdigest()
+
+    def calcBasinIndex(self, lon, lat, basin=None):
+        if basin is None:
+            basin = self.basin
+        if basin in Sections:
+            # the cells around the points of the section
+            operator = self.getSectionOperator(lon,lat,basin)
         lon, lat  = np.meshgrid(lon, lat)
         # mask which is one in the basin and masked elsewhere
         # so a field multiplied by the mask retains its values
         # in the basin and gets masked outside
         basinmask = np.ma.masked_all(lat.shape)
-        if self.basin=='Antarctic':
+        if basin=='Antarctic':
             # Antarctic shelf/deep regions
             iy, ix = np.where(((lon>330) & (lon<=360) & (lat<=-60)) | ((lon>0) & (lon<=35) & (lat<=-60))    |
                               ((lon>35)  & (lon<=68) & (lat<=-61))  | ((lon>68) & (lon<=95) & (lat<=-60))   |
@@ -199,86 +1101,199 @@ class Product(object):
                               ((lon>160) & (lon<=235) & (lat<=-66)) | ((lon>235) & (lon<=280) & (lat<=-68)) |
                               ((lon>280) & (lon<=300) & (lat<=-66)) | ((lon>300) & (lon<=315) & (lat<=-64)) |
                               ((lon>315) & (lon<=330) & (lat<=-62)))
-        elif self.basin=='Arctic':
+        elif basin=='Arctic':
             iy, ix = np.where(((lon>100) & (lon<250) & (lat>70)) |
                               ((lon<=100) & (lat>80)) |
                               ((lon>=250) & (lat>80)))
-        elif self.basin=='Eurasian':
+        elif basin=='Eurasian':
             #iy, ix = np.where(((lon<135) & (lat>80)) | ((lon>315) & (lat>80)))
             iy, ix = np.where(((lon>100)  & (lon<135) & (lat>70)) |
                               ((lon<=100) & (lat>80)) |
                               ((lon>315)  & (lat>80)))
-        elif self.basin=='Amerasian':
+        elif basin=='Amerasian':
             #iy, ix = np.where((lon>=135) & (lon<=315) & (lat>70))
             iy, ix = np.where(((lon>=135) & (lon<250)  & (lat>70)) |
                               ((lon>=250) & (lon<=315) & (lat>80)))
-        elif self.basin=='Fram Strait':
-            iy, ix = np.where(((lon>339) | (lon<11)) & ((lat>78) & (lat<80)))
-        elif self.basin=='Arctic transect':
-            """ 150W and 100E
-            """
-            iy, ix = np.where(((lon>339) | (lon<11)) & ((lat>78) & (lat<80)))
+        elif basin in Sections:
+            iy, ix = np.unravel_index(np.unique(operator.indices),lat.shape)
         else:
-            print "%s basin has not been defined!" % self.basin
+            print "%s basin has not been defined!" % basin
             sys.exit(0)
         basinmask[iy,ix]=1
         return basinmask
 
-    def readWOA13Bathymetry(self,bfile='landsea_01.msk'):
+    def getGridKey(self,lon,lat):
+        """ Fingerprint of a lon/lat grid
+        """
+        return hashlib.md5(np.ascontiguousarray(lon,dtype=float).tostring()+\
+                           np.ascontiguousarray(lat,dtype=float).tostring()).hexdigest()
+
+    def getBasinWindow(self,lon,lat):
+        """ Index windows enclosing the basins, a list of (lat slice,
+            list of lon slices). Basins whose rows overlap or are adjacent
+            share a window, others, e.g. Antarctic and Arctic, get their own.
+            There are two lon slices when the basins wrap across the grid
+            edge, e.g. Fram Strait 339E-11E. Computed once per grid.
+        """
+        key = self.getGridKey(lon,lat)
+        if key in self.basinwindows:
+            return self.basinwindows[key]
+        inbasins = [~np.ma.getmaskarray(self.findBasinIndex(lon,lat,basin))\
+                    for basin in self.basins]
+        # group the basins by their rows
+        groups = []
+        for inbasin in sorted([b for b in inbasins if b.any()],\
+                              key=lambda b: np.where(b.any(axis=1))[0][0]):
+            iy = np.where(inbasin.any(axis=1))[0]
+            if len(groups) and iy[0]<=groups[-1][1]+1:
+                groups[-1][0] |= inbasin
+                groups[-1][1] = max(groups[-1][1],iy[-1])
+            else:
+                groups.append([inbasin.copy(),iy[-1]])
+        window = []
+        for inbasin, y1 in groups:
+            iy = np.where(inbasin.any(axis=1))[0]
+            ix = np.where(inbasin.any(axis=0))[0]
+            window.append((slice(iy[0],iy[-1]+1),getCircularSlices(ix,inbasin.shape[1])))
+        self.basinwindows[key] = window
+        return window
+
+    def readBasinWindow(self,ncvar,tslice,window,ny,nx,zslice=None):
+        """ Read the basin windows of the tslice records of ncvar.
+            Returned on the full (ny,nx) grid, masked outside the windows,
+            with singleton dimensions between time and lat squeezed out.
+            zslice selects the levels of a [t,z,y,x] ncvar, see getLevelSlice.
+        """
+        nt = len(range(*tslice.indices(ncvar.shape[0])))
+        index, mdims = (tslice,), ncvar.shape[1:-2]
+        if zslice is not None:
+            index = (tslice,zslice)
+            mdims = (len(range(*zslice.indices(mdims[0]))),)+mdims[1:]
+            zdims = mdims
+        else:
+            zdims = tuple([n for n in mdims if n!=1])
+        # read first, packed variables are unpacked to another dtype
+        slabs = [(yslice,xslice,self.readVar(ncvar,index+(Ellipsis,yslice,xslice)))\
+                 for yslice, xslices in window for xslice in xslices]
+        dtype = slabs[0][2].dtype if len(slabs) else float
+        data = np.ma.masked_all((nt,)+mdims+(ny,nx),dtype=dtype)
+        for yslice, xslice, slab in slabs:
+            data[...,yslice,xslice] = slab
+        return np.ma.reshape(data,(nt,)+zdims+(ny,nx))
+
+    def getTimeSlices(self,fp,ncvar=None,years=None):
+        """ Slices of the records of fp within [syr, eyr] or years,
+            see getTimeChunks
+        """
+        return self.getTimeChunks(self.getYears(fp),ncvar,years)
+
+    def getTimeChunks(self,tyears,ncvar=None,years=None):
+        """ Slices of the records whose year in tyears is within [syr, eyr],
+            or within years (first, last) if given.
+            Each contiguous run of records is split into slabs of at most
+            tchunk records, aligned to the netCDF chunking of ncvar along
+            time if it is chunked.
+        """
+        if years is None:
+            years = (self.syr,self.eyr)
+        syr, eyr = years
+        tyears = np.asarray(tyears)
+        idx = np.where((tyears>=syr)&(tyears<=eyr))[0]
+        if not len(idx):
+            return []
+        nt = self.tchunk
+        if ncvar is not None:
+            chunking = ncvar.chunking()
+            if chunking not in [None,'contiguous']:
+                nt = max(chunking[0],nt-nt%chunking[0])
+        tslices = []
+        for run in np.split(idx,np.where(np.diff(idx)!=1)[0]+1):
+            i0, i1 = run[0], run[-1]+1
+            edges = [i0]+range((i0//nt+1)*nt,i1,nt)+[i1]
+            tslices += [slice(t0,t1) for t0,t1 in zip(edges[:-1],edges[1:])]
+        return tslices
+
+    def readWOA13Bathymetry(self,bfile=BathymetryFile):
         """ Can be downloaded from
             https://www.nodc.noaa.gov/OC5/woa13/masks13.html
+            Returns a masked copy of the shared bathymetry.
         """
-        depth = range(0,105,5)+range(125,525,25)+range(550,2050,50)+range(2100,9200,100)
-        dat = np.loadtxt(bfile,skiprows=2,delimiter=',')
-        b2d = np.reshape([depth[int(i)-1] for i in dat[:,2]],(180,360))
+        b2d = loadWOA13Bathymetry(bfile)
         #return np.ma.masked_values(np.ma.hstack((b2d[:,180:],b2d[:,:180])),0)
         return np.ma.masked_values(b2d,0)
 
-    def readOneFile(self,fn,ncvarname,maxdpth=0.):
+    def readOneFile(self,fp,ncvarname,years=None):
         """
-        Read data from a netCDF file and return its temporal mean
-        within given year range [syr, eyr] for the basin average.
+        Read data from an open netCDF file within given year range
+        [syr, eyr] or years (first, last) of it.
+        Only the windows enclosing the basins are read, the basin masks
+        are applied later. Returns also the grid.
         """
-        fp = self.getNetCDFfilepointer(fn)
         lon, lat = self.readLatLon(fp)
-        basinmask = self.findBasinIndex(lon,lat)
-        # mask too shallow regions from depth integrals as their
-        # values are too small
-        bathymask = np.ma.make_mask(self.bathymetry<maxdpth)
-        # combine basin and bathymasks
-        fldmask = np.ma.mask_or(basinmask.mask,bathymask)
-        dates    = self.getDates(fp)
+        window = self.getBasinWindow(lon,lat)
+        ncvar    = fp.variables[ncvarname]
+        FillValue = self.getFillValue(ncvar)
         ldata = []
-        for i,date in enumerate(dates[:]):
-            if date.year in range(self.syr,self.eyr+1):
-                ncvar = fp.variables[ncvarname]
-                FillValue = self.getFillValue(ncvar)
-                data = np.ma.squeeze(np.ma.array(ncvar[i]))
-                if FillValue is not None:
-                    data  = np.ma.masked_values(data,FillValue)
-                data = np.ma.array(data,mask=fldmask)
-                ldata.append(data) # do not average across the basin
-        fp.close()
-        return np.ma.array(ldata)
+        varname  = self.getStatsVarName(ncvarname)
+        for tslice in self.getTimeSlices(fp,ncvar,years):
+            data = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size)
+            data = self.maskFillValue(varname,data,FillValue)
+            ldata.append(data) # do not average across the basin
+        if not len(ldata):
+            return np.ma.array(ldata), lon, lat
+        return np.ma.concatenate(ldata), lon, lat # [t,y,x]
+
+    def getLevelEdges(self,depth):
+        """ Upper and lower edges of the level cells at depth,
+            halfway between the levels
+        """
+        depth = np.asarray(depth,dtype=float)
+        if depth.size>1:
+            bottom = depth[-1]+0.5*(depth[-1]-depth[-2])
+        else:
+            bottom = 2.*depth[0]
+        return np.hstack(([0.],0.5*(depth[1:]+depth[:-1]),[bottom]))
+
+    def getLayerOperator(self,varname,depth):
+        """ [layer,level] matrix of the thicknesses of the level cells at
+            depth within each layer of LevelBounds. Levels crossing a layer
+            bound count only with their part inside the layer.
+            Memoized per depth axis.
+        """
+        key = (varname,np.asarray(depth,dtype=float).tostring())
+        if key in self.layeroperators:
+            return self.layeroperators[key]
+        edges = self.getLevelEdges(depth)
+        lbs   = np.asarray(self.LevelBounds[varname],dtype=float)
+        upper = np.maximum(edges[np.newaxis,:-1],lbs[:,0:1])
+        lower = np.minimum(edges[np.newaxis,1:],lbs[:,1:2])
+        operator = np.maximum(lower-upper,0.)
+        self.layeroperators[key] = operator
+        return operator
+
+    def getLevelSlice(self,varname,depth):
+        """ Slice of the levels at depth within LevelBounds,
+            the other levels have no weight in getLayerOperator
+        """
+        iz = np.where(self.getLayerOperator(varname,depth).any(axis=0))[0]
+        if not len(iz):
+            return slice(0,0)
+        return slice(iz[0],iz[-1]+1)
 
-    def getLayeredDepthProfile(self,varname,depth,data):
+    def getLayeredDepthProfile(self,varname,depth,data,zslice=slice(None)):
         """
-        Average 3D hires profile data according to level_bounds
+        Thickness weighted average of 3D hires profile data [z,...]
+        according to level_bounds, returns [layer,...]
+        data has only the zslice levels of depth if it is given.
         """
-        #if data.ndim>1:
-        #    print "Warning: basin average has %d dimensions!" % data.ndim
-        ldata    = []
-        for li, lb in enumerate(self.LevelBounds[varname]):
-            iz = np.where((depth>=lb[0])&(depth<lb[1]))
-            #data1 = data[iz]
-            #data2 = data1[~np.isnan(data1)]
-            if data.ndim==1:
-                ldata.append(np.ma.mean(data[iz])) # depth average
-            else:
-                ldata.append(np.ma.mean(data[iz],axis=0)) # depth average, not basin average
-            nanmask = np.ma.make_mask(np.isnan(ldata))
-            lmask = np.ma.mask_or(np.ma.array(ldata).mask,nanmask)
-        return np.ma.array(ldata,mask=lmask)
+        t0 = time.time()
+        operator = self.getLayerOperator(varname,depth)[:,zslice]
+        data = np.ma.masked_invalid(data)
+        wsum = np.tensordot(operator,np.ma.filled(data,0.),axes=(1,0))
+        wcnt = np.tensordot(operator,(~np.ma.getmaskarray(data)).astype(float),axes=(1,0))
+        data = np.ma.divide(wsum,np.ma.masked_equal(wcnt,0))
+        self.addStats(varname,'reduce',time.time()-t0)
+        return data
 
 class CGLORS(Product):
     def __init__(self,basin,syr,eyr):
@@ -291,8 +1306,8 @@ class CGLORS(Product):
         self.linecolor = self.scattercolor = 'lightgreen'
         self.legend = 'C-GLORS025v5'
 
-    def getDates(self,fp,year,months=range(1,13)):
-        return [datetime(year,month,15) for month in months]
+    def getYears(self,fp,year,months=range(1,13)):
+        return np.array([year for month in months])
 
     def getNetCDFfilename(self,varname,year):
         if year in range(1989,1993):
@@ -304,64 +1319,65 @@ class CGLORS(Product):
         fn = self.fpat % (self.ncvarname[varname],grid,year)
         return fn, ncdepthname
 
-    def readProfile(self):
+    def getInputFiles(self):
+        return [self.getNetCDFfilename(varname,year)[0] for varname in ['S','T']\
+                for year in range(self.syr,self.eyr+1)]
+
+    def iterYearSlabs(self,varname):
         """ varname is either T or S
-        Read data from a netCDF file and return its temporal mean
-        for the basin averaged values.
+            Generate the [t,z,y,x] slabs of each year in the basin windows
+            with the depth axis, the levels read and the grid
         """
-        for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            ncvarname = self.ncvarname[varname]
-            tdata = []
-            for year in range(self.syr,self.eyr+1):
-                fn, ncdepthname = self.getNetCDFfilename(varname,year)
-                fp = self.getNetCDFfilepointer(fn)
+        ncvarname = self.ncvarname[varname]
+        for year in range(self.syr,self.eyr+1):
+            fn, ncdepthname = self.getNetCDFfilename(varname,year)
+            fp = self.getNetCDFfilepointer(fn)
+            try:
                 lon, lat = self.readLatLon(fp)
-                dates    = self.getDates(fp,year)
+                tyears   = self.getYears(fp,year)
                 depth    = np.array(fp.variables[ncdepthname])
-                basinmask = self.findBasinIndex(lon,lat)
+                zslice   = self.getLevelSlice(varname,depth)
+                window   = self.getBasinWindow(lon,lat)
                 ncvar    = fp.variables[ncvarname]
                 FillValue = self.getFillValue(ncvar)
-                for i,date in enumerate(dates[:]):
-                    if date.year in range(self.syr,self.eyr+1):
-                       data = np.ma.array(fp.variables[ncvarname][i])
-                       if FillValue is None:
-                           data *= basinmask
-                       else:
-                           data  = np.ma.masked_values(data, FillValue)*basinmask
-                       # basin average
-                       data_ba = np.ma.mean(data,axis=tuple(range(1, data.ndim)))
-                       tdata.append(self.getLayeredDepthProfile(varname,depth,data_ba))
-                fp.close()
-            pdata.data = np.ma.mean(tdata,axis=0) # temporal average
+                for tslice in self.getTimeChunks(tyears,ncvar):
+                    data = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size,zslice) # [t,z,y,x]
+                    data = self.maskFillValue(varname,data,FillValue)
+                    yield data, depth, zslice, lon, lat
+            finally:
+                self.closeNetCDFfilepointer(fp)
+
+    def readProfile(self):
+        """ varname is either T or S
+        Read data from a netCDF file and return its temporal mean
+        for the basin averaged values.
+        """
+        for varname in ['S','T']:
+            tdata = dict([(basin,Accumulator()) for basin in self.basins])
+            for data, depth, zslice, lon, lat in \
+                prefetch(self.iterYearSlabs(varname),self.prefetchdepth):
+                # basin averages
+                for basin, data_ba in self.averageBasins(data,lon,lat,varname).items():
+                    tdata[basin].add(self.getLayeredDepthProfile(varname,depth,data_ba.T,zslice).T)
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean() # temporal average
 
     def readTransect(self,maxis=(0,2)):
         """ varname is either T or S
         Read data from a netCDF file and return its temporal mean
         """
         for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            ncvarname = self.ncvarname[varname]
-            tdata = []
-            for year in range(self.syr,self.eyr+1):
-                fn, ncdepthname = self.getNetCDFfilename(varname,year)
-                fp = self.getNetCDFfilepointer(fn)
-                lon, lat = self.readLatLon(fp)
-                dates    = self.getDates(fp,year)
-                depth    = np.array(fp.variables[ncdepthname])
-                basinmask = self.findBasinIndex(lon,lat)
-                ncvar    = fp.variables[ncvarname]
-                FillValue = self.getFillValue(ncvar)
-                for i,date in enumerate(dates[:]):
-                    if date.year in range(self.syr,self.eyr+1):
-                       data = np.ma.array(fp.variables[ncvarname][i])
-                       if FillValue is None:
-                           data *= basinmask
-                       else:
-                           data  = np.ma.masked_values(data, FillValue)*basinmask
-                       tdata.append(self.getLayeredDepthProfile(varname,depth,data))
-                fp.close()
-            pdata.data = np.ma.mean(tdata,axis=maxis) # temporal average
+            tdata = dict([(basin,Accumulator(maxis)) for basin in self.basins])
+            for data, depth, zslice, lon, lat in \
+                prefetch(self.iterYearSlabs(varname),self.prefetchdepth):
+                for basin in self.basins:
+                    bdata = self.selectTransect(data,lon,lat,basin)
+                    ldata = self.getLayeredDepthProfile(varname,depth,np.ma.swapaxes(bdata,0,1),zslice)
+                    tdata[basin].add(np.ma.swapaxes(ldata,0,1))
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean() # temporal average
 
 class ECDA(Product):
     def __init__(self,basin,syr,eyr):
@@ -375,17 +1391,6 @@ class ECDA(Product):
         self.lettercolor = 'black'
         self.legend = 'ECDA3'
 
-    def getDates(self,fp):
-        if fp.variables.has_key(self.nctimename):
-            time = fp.variables[self.nctimename]
-        else:
-            time = fp.variables[self.nctimename.upper()]
-        if hasattr(time,'calendar'):
-            cdftime = utime(time.units,calendar=time.calendar.lower())
-        else:
-            cdftime = utime(time.units)
-        return [cdftime.num2date(t) for t in time[:]]
-
 class GloSea5(Product):
     def __init__(self,basin,syr,eyr):
         super( GloSea5, self).__init__(basin,syr,eyr)
@@ -414,17 +1419,6 @@ class MOVEG2(Product):
         self.linecolor = self.scattercolor = 'cyan'
         self.lettercolor = 'black'
 
-    def getDates(self,fp):
-        time = fp.variables[self.nctimename]
-        if hasattr(time,'calendar'): #T
-            cdftime = utime(time.units,calendar=time.calendar)
-            dates = [cdftime.num2date(t) for t in time[:]]
-        else: #S
-            m = re.search('months since\s+(\d+)-(\d+)-(\d+)',time.units)
-            year0, month0, day0 = [int(s) for s in m.groups()]
-            dates = [datetime(year0+int(t/12),month0+int(t%12),day0) for t in time[:]]
-        return dates
-
 class UoR(Product):
     def __init__(self,basin,syr,eyr):
         super( UoR, self).__init__(basin,syr,eyr)
@@ -449,24 +1443,14 @@ class EN4(Product):
         self.linecolor = 'green'
         self.scattercolor = 'darkgrey'
         self.linestyle = '-.'
-        self.bathymetry = self.bathymetry[7:,:]
 
-    def readVarProfile(self,varname):
-        """ varname is either T or S
+    def readWOA13Bathymetry(self,bfile=BathymetryFile):
+        """ EN4 grid starts from 82.5S
         """
-        data = []
-        for li, lb in enumerate(self.LevelBounds[varname]):
-            ncvarname = "%s%d" % (self.ncvarname[varname],lb[1])
-            fn    = self.getNetCDFfilename(varname,0,lb[1])
-            ldata = self.readOneFile(fn,ncvarname,lb[1])
-            if lb[0]==0.:
-                udata = 0.0*ldata
-            else:
-                ncvarname = "%s%d" % (self.ncvarname[varname],lb[0])
-                fn    = self.getNetCDFfilename(varname,0,lb[0])
-                udata = self.readOneFile(fn,ncvarname,lb[0])
-            data.append((ldata - udata)/(lb[1] - lb[0])) # [t,x,y] variable values from level averages
-        return np.ma.array(data) # [z,t,x,y]
+        return super( EN4, self).readWOA13Bathymetry(bfile)[7:,:]
+
+    def getCumulativeNcVarName(self,varname,dpth):
+        return "%s%d" % (self.ncvarname[varname],dpth)
 
 class GECCO2(Product):
     def __init__(self,basin,syr,eyr):
@@ -480,83 +1464,75 @@ class GECCO2(Product):
         self.legend = 'GECCO2'
         self.FillValue = -1e34
 
-    def getGECCO2SalinityDates(self,fp):
-        return [datetime(year,1,1) for year in range(self.dsyr,self.deyr+1)]
+    def getGECCO2SalinityFilename(self):
+        return 'GECCO2_intS_annmean_1948to2011_all_layers_r360x180.nc'
 
-    def readOneSalinityField(self,fp,varname,maxdpth,basinmask,i):
-        # mask too shallow regions from depth integrals as their
-        # values are too small
-        bathymask = np.ma.make_mask(self.bathymetry<maxdpth)
-        # combine basin and bathymasks
-        fldmask = np.ma.mask_or(basinmask.mask,bathymask)
-        ncvarname = self.ncvarname[varname] % maxdpth
-        ncvar = fp.variables[ncvarname]
-        # GECCO2 salinity data lons are from -179.5 to 179.5
-        #data = np.ma.squeeze(np.ma.array(ncvar[i,:,self.lix]))
-        data = np.ma.hstack((ncvar[i][:,180:],ncvar[i][:,:180]))
-        ldata  = np.ma.array(data,mask=fldmask)
-        return np.ma.masked_values(ldata,self.FillValue) # do not average across the basin
+    def getInputFiles(self):
+        fns = [self.getGECCO2SalinityFilename()]
+        for dpth in np.unique(self.LevelBounds['T']):
+            if dpth!=0.:
+                fns.append(self.getNetCDFfilename('T',0,dpth))
+        return fns
+
+    def getGECCO2SalinityYears(self,fp):
+        return np.arange(self.dsyr,self.deyr+1)
+
+    def getGECCO2SalinityLonOrder(self,lon):
+        """ Permutation of the lons of the salinity file, which are
+            from -179.5 to 179.5, starting from 0E as in the T files
+        """
+        return np.argsort(np.mod(lon,360.),kind='mergesort')
+
+    def readSalinityFields(self,fp,varname,records,lonorder):
+        """ Salinity of the records slice as the cumulative 0-Xm integrals
+            {X: [t,y,x]}, see getCumulativeLayers. The S_0_X fields are mean
+            salinities over 0-Xm, each is read once with lons in lonorder.
+        """
+        cumdata = {}
+        for dpth in np.unique(self.LevelBounds[varname]):
+            if dpth==0.:
+                continue
+            ncvar = fp.variables[self.ncvarname[varname] % dpth]
+            data  = self.readVar(ncvar,records)[...,lonorder]
+            # do not average across the basin
+            cumdata[dpth] = self.maskFillValue(varname,data,self.FillValue)*dpth
+        return cumdata
 
     def readGECCO2Profile(self):
-        data = {'T':[],'S':[]} # [z,t,y,x]
-        data['S'] = self.readGECCO2SalinityProfile()
-        # read temperature profile
-        data['T'] = self.readVarProfile('T')
-        data = self.maskBadSalinity(data)
-        self.averageBasinAndTime(data)
+        # salinity from all layers file and temperature profile
+        self.reduceVarProfiles(self.iterGECCO2SalinityProfile(),self.iterVarProfile('T'))
 
     def readGECCO2Transect(self,maxis=(1,2)):
-        data = {'T':[],'S':[]} # [z,t,y,x]
-        data['S'] = self.readGECCO2SalinityProfile()
-        # read temperature profile
-        data['T'] = self.readVarProfile('T')
-        data = self.maskBadSalinity(data)
-        # average according to maxis (leaving transect)
-        # maxis = (1,2) would be a time-average of a meridional transect
-        for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            pdata.data = np.ma.mean(data[varname],\
-                         axis=maxis) # time and basin average
+        self.reduceVarProfiles(self.iterGECCO2SalinityProfile(),self.iterVarProfile('T'),maxis)
 
     def readGECCO2TemperatureProfile(self,varname='T'):
-        tdata = [] # [z,t,y,x]
-        for li, lb in enumerate(self.LevelBounds[varname]):
-            ncvarname = self.ncvarname[varname]
-            fn    = self.getNetCDFfilename(varname,0,lb[1])
-            ldata = self.readOneFile(fn,ncvarname,lb[1])
-            if lb[0]==0.:
-                udata = 0.0*ldata
-            else:
-                ncvarname = self.ncvarname[varname]
-                fn    = self.getNetCDFfilename(varname,0,lb[0])
-                udata = self.readOneFile(fn,ncvarname,lb[0])
-            tdata.append((ldata - udata)/(lb[1] - lb[0])) # [t,x,y] variable values from level averages
-        return np.ma.array(tdata)
+        return self.readVarProfile(varname) # [z,t,y,x], lon, lat
 
     def readGECCO2SalinityProfile(self,varname='S'):
-        fn = 'GECCO2_intS_annmean_1948to2011_all_layers_r360x180.nc'
+        data, lon, lat = zip(*self.iterGECCO2SalinityProfile(varname))
+        return np.ma.concatenate(data,axis=1), lon[0], lat[0] # [z,t,y,x]
+
+    def iterGECCO2SalinityProfile(self,varname='S'):
+        """ Generate the salinity layers [z,t,y,x] and the grid
+            per block of years, see iterVarProfile
+        """
+        fn = self.getGECCO2SalinityFilename()
         fp = self.getNetCDFfilepointer(fn)
         lon, lat  = self.readLatLon(fp)
         # GECCO2 salinity data lons are from -179.5 to 179.5
-        lon       = np.hstack((lon[180:],lon[:180]))
-        dates     = self.getGECCO2SalinityDates(fp)
-        basinmask = self.findBasinIndex(lon,lat)
-        pdata     = getattr(self,varname)
-        tdata     = []
-        for i,date in enumerate(dates):
-            if date.year in range(self.syr,self.eyr+1):
-                ldata = []
-                for li, lb in enumerate(self.LevelBounds[varname]):
-                    lldata = self.readOneSalinityField(fp,varname,lb[1],basinmask,i)
-                    if lb[0]==0.:
-                        ludata = 0.0*lldata
-                    else:
-                        ludata = self.readOneSalinityField(fp,varname,lb[1],basinmask,i)
-                    ldata.append((lldata*lb[1] - ludata*lb[0])/(lb[1] - lb[0])) # [z,y,x]
-                tdata.append(ldata) # [t,z,y,x]
-        fp.close()
-        tdata = np.ma.masked_values(tdata,self.FillValue)
-        return np.ma.swapaxes(tdata,0,1) # do not temporal average, -> [z,t,y,x]
+        lonorder  = self.getGECCO2SalinityLonOrder(lon)
+        lon       = lon[lonorder]
+        tyears    = self.getGECCO2SalinityYears(fp)
+        try:
+            for syr, eyr in self.getYearChunks():
+                it = np.where((tyears>=syr) & (tyears<=eyr))[0]
+                if not len(it):
+                    continue
+                cumdata = self.readSalinityFields(fp,varname,slice(it[0],it[-1]+1),lonorder)
+                # not masked by basin yet, see maskBasin
+                yield self.getCumulativeLayers(varname,cumdata), lon, lat # do not temporal average, -> [z,t,y,x]
+        finally:
+            self.closeNetCDFfilepointer(fp)
 
 class GLORYS2V4(Product):
     def __init__(self,basin,syr,eyr):
@@ -576,44 +1552,39 @@ class GLORYS2V4(Product):
             fn = self.fpat % ('SC')
         return fn
 
-    def readOneField(self,fp,varname,maxdpth,basinmask,i):
-        # mask too shallow regions from depth integrals as their
-        # values are too small
-        bathymask = np.ma.make_mask(self.bathymetry<maxdpth)
-        # combine basin and bathymasks
-        fldmask = np.ma.mask_or(basinmask.mask,bathymask)
+    def getInputFiles(self):
+        return [self.getNetCDFfilename(varname) for varname in ['S','T']]
+
+    def readOneField(self,fp,varname,maxdpth,tslice):
         ncvarname = self.ncvarname[varname] % maxdpth
         ncvar = fp.variables[ncvarname]
         FillValue = self.getFillValue(ncvar)
-        data = np.ma.squeeze(np.ma.array(ncvar[i]))
-        if FillValue is not None:
-           data  = np.ma.masked_values(data,FillValue)
-        ldata  = np.ma.array(data,mask=fldmask)
-        return np.ma.array(ldata) # do not average across the basin
+        data = np.ma.array(self.readVar(ncvar,tslice)) # [t,y,x]
+        return self.maskFillValue(varname,data,FillValue) # do not average across the basin
 
-    def readVarProfile(self,varname):
+    def iterCumulativeFields(self,varname):
         """ varname is either T or S
+            Each cumulative z<X>heatc|saltc variable is read once per
+            block of years, generates {X: [t,y,x]} and the grid
         """
         fn = self.getNetCDFfilename(varname)
         fp = self.getNetCDFfilepointer(fn)
         lon, lat  = self.readLatLon(fp)
-        dates     = self.getDates(fp)
-        depth     = np.array(fp.variables[self.ncdepthname])
-        basinmask = self.findBasinIndex(lon,lat)
-        data = []
-        for i,date in enumerate(dates[:]):
-            if date.year in range(self.syr,self.eyr+1):
-                mdata = []
-                for li, lb in enumerate(self.LevelBounds[varname]):
-                    lldata = self.readOneField(fp,varname,lb[1],basinmask,i)
-                    if lb[0]==0.:
-                        ludata = 0.0*lldata
-                    else:
-                        ludata = self.readOneField(fp,varname,lb[0],basinmask,i)
-                    mdata.append((lldata - ludata)/(lb[1] - lb[0]))
-                data.append(np.ma.array(mdata)) # [t,z,y,x]
-        fp.close()
-        return np.ma.swapaxes(data,0,1) # [t,z,y,x] -> [z,t,y,x]
+        tyears    = self.getYears(fp)
+        try:
+            for years in self.getYearChunks():
+                tslices   = self.getTimeChunks(tyears,years=years)
+                if not len(tslices):
+                    continue
+                cumdata   = {}
+                for dpth in np.unique(self.LevelBounds[varname]):
+                    if dpth==0.:
+                        continue
+                    cumdata[dpth] = np.ma.concatenate([self.readOneField(fp,varname,dpth,tslice)\
+                                                       for tslice in tslices]) # [t,y,x]
+                yield cumdata, lon, lat
+        finally:
+            self.closeNetCDFfilepointer(fp)
 
 class TOPAZ(Product):
     def __init__(self,basin,syr,eyr):
@@ -635,19 +1606,30 @@ class TOPAZ(Product):
             fn = self.fpat % ('salt',year,month)
         return fn
 
+    def getInputFiles(self):
+        return [self.getNetCDFfilename(varname,year,month) for varname in ['S','T']\
+                for year in range(self.syr,self.eyr+1) for month in range(1,13)]
+
     def readMonthlyVar(self,varname,year,month):
         fn = self.getNetCDFfilename(varname,year,month)
         fp = self.getNetCDFfilepointer(fn)
         lon, lat = self.readLatLon(fp)
         depth    = np.array(fp.variables[self.ncdepthname])
-        basinmask= self.findBasinIndex(lon,lat)
+        zslice   = self.getLevelSlice(varname,depth)
         ncvarname = self.ncvarname[varname]
         ncvar    = fp.variables[ncvarname]
         FillValue = self.getFillValue(ncvar)
-        data     = np.ma.array(fp.variables[ncvarname])
-        data     = np.ma.masked_values(data, FillValue)*basinmask
-        fp.close()
-        return data, depth
+        # levels are the records of the [z,y,x] TOPAZ files
+        data     = self.readBasinWindow(ncvar,zslice,self.getBasinWindow(lon,lat),lat.size,lon.size)
+        data     = self.maskFillValue(varname,data,FillValue)
+        self.closeNetCDFfilepointer(fp)
+        # not masked by basin yet, only the zslice levels of depth
+        return data, depth, zslice, lon, lat
+
+    def iterMonthlyVars(self,varname):
+        for year in range(self.syr,self.eyr+1):
+            for month in range(1,13):
+                yield self.readMonthlyVar(varname,year,month)
 
     def readProfile(self):
         """ varname is either T or S
@@ -655,14 +1637,14 @@ class TOPAZ(Product):
         for the basin-averaged profile.
         """
         for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            tdata = []
-            for year in range(self.syr,self.eyr+1):
-                for month in range(1,13):
-                    data, depth = self.readMonthlyVar(varname,year,month)
-                    data_ba  = np.ma.mean(data,axis=tuple(range(1, data.ndim)))
-                    tdata.append(self.getLayeredDepthProfile(varname,depth,data_ba))
-            pdata.data = np.ma.mean(tdata,axis=0)
+            tdata = dict([(basin,Accumulator()) for basin in self.basins])
+            for data, depth, zslice, lon, lat in \
+                prefetch(self.iterMonthlyVars(varname),self.prefetchdepth):
+                for basin, data_ba in self.averageBasins(data,lon,lat,varname).items():
+                    tdata[basin].add(self.getLayeredDepthProfile(varname,depth,data_ba,zslice)[np.newaxis])
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
     def readTransect(self,maxis=(0,2)):
         """ varname is either T or S
@@ -670,13 +1652,15 @@ class TOPAZ(Product):
         for the basin-averaged profile.
         """
         for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            tdata = []
-            for year in range(self.syr,self.eyr+1):
-                for month in range(1,13):
-                    data, depth = self.readMonthlyVar(varname,year,month)
-                    tdata.append(self.getLayeredDepthProfile(varname,depth,data))
-            pdata.data = np.ma.mean(tdata,axis=maxis)
+            tdata = dict([(basin,Accumulator(maxis)) for basin in self.basins])
+            for data, depth, zslice, lon, lat in \
+                prefetch(self.iterMonthlyVars(varname),self.prefetchdepth):
+                for basin in self.basins:
+                    bdata = self.selectTransect(data,lon,lat,basin)
+                    tdata[basin].add(self.getLayeredDepthProfile(varname,depth,bdata,zslice)[np.newaxis])
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
 class MultiModelMean(Product):
     def __init__(self,basin):
@@ -706,6 +1690,9 @@ class Sumata(Product):
     def getNetCDFfilename(self):
         return self.fpat
 
+    def getInputFiles(self):
+        return [self.getNetCDFfilename()]
+
     def readProfile(self):
         """ varname is either T or S
         Read data from a netCDF file and return its temporal mean
@@ -716,26 +1703,23 @@ class Sumata(Product):
         lon, lat  = self.readLatLon(fp)
         lon = np.ma.hstack((lon[180:],lon[:180]))
         depth = np.array(fp.variables[self.ncdepthname])
-        basinmask = self.findBasinIndex(lon,lat)
         for varname in ['S','T']:
             ncvarname = self.ncvarname[varname]
             ncvar     = fp.variables[ncvarname]
             FillValue = self.getFillValue(ncvar)
-            pdata = getattr(self,varname)
-            # odata is orginal, non-depth-averaged data
-            tdata, odata = [], []
-            setattr(pdata,'depth',depth)
             # if seasonal average is not representative we may
             # need to plot seasons separately
-            for i in range(4):
-                data    = np.ma.concatenate((ncvar[i][:,:,180:],ncvar[i][:,:,:180]),axis=2)
-                data    = np.ma.masked_values(data,FillValue)*basinmask
-                data_ba = np.ma.mean(data,axis=tuple(range(1, data.ndim)))
-                odata.append(data_ba)
-                tdata.append(self.getLayeredDepthProfile(varname,depth,data_ba))
-            pdata.data = np.ma.mean(tdata,axis=0)
-            setattr(pdata,'odata',np.ma.mean(odata,axis=0))
-        fp.close()
+            data    = self.readVar(ncvar,slice(0,4)) # [season,z,y,x]
+            data    = np.ma.concatenate((data[...,180:],data[...,:180]),axis=3)
+            data    = self.maskFillValue(varname,data,FillValue)
+            for basin, odata in self.averageBasins(data,lon,lat,varname).items():
+                pdata = self.getProfVar(varname,basin)
+                # odata is orginal, non-depth-averaged data
+                setattr(pdata,'depth',depth)
+                tdata   = self.getLayeredDepthProfile(varname,depth,odata.T).T
+                pdata.data = np.ma.mean(tdata,axis=0)
+                setattr(pdata,'odata',np.ma.mean(odata,axis=0))
+        self.closeNetCDFfilepointer(fp)
 
     def readTransect(self,maxis=(0,2)):
         """ varname is either T or S
@@ -747,20 +1731,19 @@ class Sumata(Product):
         fp = self.getNetCDFfilepointer(fn)
         lon, lat  = self.readLatLon(fp)
         depth     = np.array(fp.variables[self.ncdepthname])
-        basinmask = self.findBasinIndex(lon,lat)
         for varname in ['S','T']:
             ncvarname = self.ncvarname[varname]
             ncvar     = fp.variables[ncvarname]
             FillValue = self.getFillValue(ncvar)
-            pdata = getattr(self,varname)
-            tdata = []
             # if seasonal average is not representative we may
             # need to plot seasons separately
-            for i in range(4):
-                data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                tdata.append(self.getLayeredDepthProfile(varname,depth,data))
-            pdata.data = np.ma.mean(tdata,axis=maxis)
-        fp.close()
+            data    = self.maskFillValue(varname,self.readVar(ncvar,slice(0,4)),FillValue)
+            for basin in self.basins:
+                pdata   = self.getProfVar(varname,basin)
+                bdata   = self.selectTransect(data,lon,lat,basin)
+                tdata   = self.getLayeredDepthProfile(varname,depth,np.ma.swapaxes(bdata,0,1))
+                pdata.data = np.ma.mean(np.ma.swapaxes(tdata,0,1),axis=maxis)
+        self.closeNetCDFfilepointer(fp)
 
 class WOA13(Sumata):
     def __init__(self,basin,syr=1995,eyr=2012):
@@ -786,12 +1769,6 @@ class ORAP5(Product):
         self.linecolor = self.scattercolor = 'red'
         self.legend = 'ORAP5'
 
-    def getDates(self,fp):
-        time = fp.variables[self.nctimename]
-        m = re.search('month.*since\s+(\d+)-(\d+)-(\d+)',time.units)
-        year0, month0, day0 = [int(s) for s in m.groups()]
-        return [datetime(year0+int(t/12),month0+int(t%12),day0) for t in time[:]]
-
     def getNetCDFfilename(self,varname):
         if varname=='T':
             fn = self.fpat % ('temperature',self.dsyr,self.deyr)
@@ -799,6 +1776,9 @@ class ORAP5(Product):
             fn = self.fpat % ('salinity',self.dsyr,self.deyr)
         return fn
 
+    def getInputFiles(self):
+        return [self.getNetCDFfilename(varname) for varname in ['S','T']]
+
     def readProfile(self):
         """ varname is either T or S
         Read data from a netCDF file and return its temporal mean
@@ -808,21 +1788,22 @@ class ORAP5(Product):
             fn = self.getNetCDFfilename(varname)
             fp = self.getNetCDFfilepointer(fn)
             lon, lat  = self.readLatLon(fp)
-            dates     = self.getDates(fp)
             depth     = np.array(fp.variables[self.ncdepthname])
-            basinmask = self.findBasinIndex(lon,lat)
+            zslice    = self.getLevelSlice(varname,depth)
+            window    = self.getBasinWindow(lon,lat)
             ncvarname = self.ncvarname[varname]
             ncvar     = fp.variables[ncvarname]
             FillValue = self.getFillValue(ncvar)
-            pdata     = getattr(self,varname)
-            tdata     = []
-            for i,date in enumerate(dates[:]):
-                if date.year in range(self.syr,self.eyr+1):
-                    data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                    data_ba = np.ma.mean(data,axis=tuple(range(1, data.ndim)))
-                    tdata.append(self.getLayeredDepthProfile(varname,depth,data_ba))
-            fp.close()
-            pdata.data = np.ma.mean(tdata,axis=0)
+            tdata     = dict([(basin,Accumulator()) for basin in self.basins])
+            for tslice in self.getTimeSlices(fp,ncvar):
+                data    = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size,zslice)
+                data    = self.maskFillValue(varname,data,FillValue)
+                for basin, data_ba in self.averageBasins(data,lon,lat,varname).items():
+                    tdata[basin].add(self.getLayeredDepthProfile(varname,depth,data_ba.T,zslice).T)
+            self.closeNetCDFfilepointer(fp)
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
     def readTransect(self,maxis=(0,2)):
         """ varname is either T or S
@@ -833,20 +1814,24 @@ class ORAP5(Product):
             fn = self.getNetCDFfilename(varname)
             fp = self.getNetCDFfilepointer(fn)
             lon, lat  = self.readLatLon(fp)
-            dates     = self.getDates(fp)
             depth     = np.array(fp.variables[self.ncdepthname])
-            basinmask = self.findBasinIndex(lon,lat)
+            zslice    = self.getLevelSlice(varname,depth)
+            window    = self.getBasinWindow(lon,lat)
             ncvarname = self.ncvarname[varname]
             ncvar     = fp.variables[ncvarname]
             FillValue = self.getFillValue(ncvar)
-            pdata     = getattr(self,varname)
-            tdata     = []
-            for i,date in enumerate(dates[:]):
-                if date.year in range(self.syr,self.eyr+1):
-                    data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                    tdata.append(self.getLayeredDepthProfile(varname,depth,data))
-            fp.close()
-            pdata.data = np.ma.mean(tdata,axis=maxis)
+            tdata     = dict([(basin,Accumulator(maxis)) for basin in self.basins])
+            for tslice in self.getTimeSlices(fp,ncvar):
+                data    = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size,zslice)
+                data    = self.maskFillValue(varname,data,FillValue)
+                for basin in self.basins:
+                    bdata   = self.selectTransect(data,lon,lat,basin)
+                    ldata   = self.getLayeredDepthProfile(varname,depth,np.ma.swapaxes(bdata,0,1),zslice)
+                    tdata[basin].add(np.ma.swapaxes(ldata,0,1))
+            self.closeNetCDFfilepointer(fp)
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
 class MOVEG2i(Product):
     def __init__(self,basin,syr,eyr):
@@ -861,12 +1846,6 @@ class MOVEG2i(Product):
         self.linecolor = self.scattercolor = 'cyan'
         self.legend = 'MOVE-G2i'
 
-    def getDates(self,fp):
-        time = fp.variables[self.nctimename]
-        m = re.search('month.*since\s+(\d+)-(\d+)-(\d+)',time.units)
-        year0, month0, day0 = [int(s) for s in m.groups()]
-        return [datetime(year0+int(t/12),month0+int(t%12),day0) for t in time[:]]
-
     def getNetCDFfilename(self,varname):
         if varname=='T':
             fn = self.fpat % ('temp',self.dsyr,self.deyr)
@@ -874,6 +1853,9 @@ class MOVEG2i(Product):
             fn = self.fpat % ('sal',self.dsyr,self.deyr)
         return fn
 
+    def getInputFiles(self):
+        return [self.getNetCDFfilename(varname) for varname in ['S','T']]
+
     def readProfile(self):
         """ varname is either T or S
         Read data from a netCDF file and return its temporal mean
@@ -883,24 +1865,25 @@ class MOVEG2i(Product):
             fn = self.getNetCDFfilename(varname)
             fp = self.getNetCDFfilepointer(fn)
             lon, lat  = self.readLatLon(fp)
-            dates     = self.getDates(fp)
             depth     = np.array(fp.variables[self.ncdepthname])
-            basinmask = self.findBasinIndex(lon,lat)
+            zslice    = self.getLevelSlice(varname,depth)
+            window    = self.getBasinWindow(lon,lat)
             ncvarname = self.ncvarname[varname]
             ncvar     = fp.variables[ncvarname]
             FillValue = self.getFillValue(ncvar)
-            pdata     = getattr(self,varname)
-            tdata     = []
-            for i,date in enumerate(dates[:]):
-                if date.year in range(self.syr,self.eyr+1):
-                    data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                    # Note that data is (nz,ny,nx) and basinmask (ny,nx)
-                    # their multiplication data*basinmask returns (nz,ny,nz) where
-                    # each data[nz] is multiplied by basinmask, clever eh?
-                    data_ba = np.ma.mean(data,axis=tuple(range(1, data.ndim)))
-                    tdata.append(self.getLayeredDepthProfile(varname,depth,data_ba))
-            fp.close()
-            pdata.data = np.ma.mean(tdata,axis=0)
+            tdata     = dict([(basin,Accumulator()) for basin in self.basins])
+            for tslice in self.getTimeSlices(fp,ncvar):
+                data    = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size,zslice)
+                data    = self.maskFillValue(varname,data,FillValue)
+                # Note that data is (nt,nz,ny,nx) and basinmask (ny,nx)
+                # their multiplication data*basinmask returns (nt,nz,ny,nx) where
+                # each data[nt,nz] is multiplied by basinmask, clever eh?
+                for basin, data_ba in self.averageBasins(data,lon,lat,varname).items():
+                    tdata[basin].add(self.getLayeredDepthProfile(varname,depth,data_ba.T,zslice).T)
+            self.closeNetCDFfilepointer(fp)
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
     def readTransect(self,maxis=(0,2)):
         """ varname is either T or S
@@ -911,23 +1894,27 @@ class MOVEG2i(Product):
             fn = self.getNetCDFfilename(varname)
             fp = self.getNetCDFfilepointer(fn)
             lon, lat  = self.readLatLon(fp)
-            dates     = self.getDates(fp)
             depth     = np.array(fp.variables[self.ncdepthname])
-            basinmask = self.findBasinIndex(lon,lat)
+            zslice    = self.getLevelSlice(varname,depth)
+            window    = self.getBasinWindow(lon,lat)
             ncvarname = self.ncvarname[varname]
             ncvar     = fp.variables[ncvarname]
             FillValue = self.getFillValue(ncvar)
-            pdata     = getattr(self,varname)
-            tdata     = []
-            for i,date in enumerate(dates[:]):
-                if date.year in range(self.syr,self.eyr+1):
-                    data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                    # Note that data is (nz,ny,nx) and basinmask (ny,nx)
-                    # their multiplication data*basinmask returns (nz,ny,nz) where
-                    # each data[nz] is multiplied by basinmask, clever eh?
-                    tdata.append(self.getLayeredDepthProfile(varname,depth,data))
-            fp.close()
-            pdata.data = np.ma.mean(tdata,axis=maxis)
+            tdata     = dict([(basin,Accumulator(maxis)) for basin in self.basins])
+            for tslice in self.getTimeSlices(fp,ncvar):
+                data    = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size,zslice)
+                data    = self.maskFillValue(varname,data,FillValue)
+                for basin in self.basins:
+                    # Note that data is (nt,nz,ny,nx) and basinmask (ny,nx)
+                    # their multiplication data*basinmask returns (nt,nz,ny,nx) where
+                    # each data[nt,nz] is multiplied by basinmask, clever eh?
+                    bdata   = self.selectTransect(data,lon,lat,basin)
+                    ldata   = self.getLayeredDepthProfile(varname,depth,np.ma.swapaxes(bdata,0,1),zslice)
+                    tdata[basin].add(np.ma.swapaxes(ldata,0,1))
+            self.closeNetCDFfilepointer(fp)
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
 class SODA331(Product):
     def __init__(self,basin,syr,eyr):
@@ -943,8 +1930,8 @@ class SODA331(Product):
         self.linecolor = self.scattercolor = 'purple'
         self.legend = 'SODA3.3.1'
 
-    def getDates(self,fp,year,months=range(1,13)):
-        return [datetime(year,month,1) for month in months]
+    def getYears(self,fp,year,months=range(1,13)):
+        return np.array([year for month in months])
 
     def getNetCDFfilename(self,varname,year):
         if varname=='T':
@@ -953,31 +1940,47 @@ class SODA331(Product):
             fn = self.fpat % ('salinity','salinity',year)
         return fn
 
-    def readProfile(self):
+    def getInputFiles(self):
+        return [self.getNetCDFfilename(varname,year) for varname in ['S','T']\
+                for year in range(self.syr,self.eyr+1)]
+
+    def iterYearSlabs(self,varname):
         """ varname is either T or S
-        Read data from a netCDF file and return its temporal mean
-        for the basin-averaged profile.
+            Generate the [t,z,y,x] slabs of each year in the basin windows
+            with the depth axis, the levels read and the grid
         """
-        for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            ncvarname = self.ncvarname[varname]
-            tdata = []
-            for year in range(self.syr,self.eyr+1):
-                fn = self.getNetCDFfilename(varname,year)
-                fp = self.getNetCDFfilepointer(fn)
+        ncvarname = self.ncvarname[varname]
+        for year in range(self.syr,self.eyr+1):
+            fn = self.getNetCDFfilename(varname,year)
+            fp = self.getNetCDFfilepointer(fn)
+            try:
                 lon, lat = self.readLatLon(fp)
-                dates    = self.getDates(fp,year)
+                tyears   = self.getYears(fp,year)
                 depth    = np.array(fp.variables[self.ncdepthname])
-                basinmask= self.findBasinIndex(lon,lat)
+                zslice   = self.getLevelSlice(varname,depth)
+                window   = self.getBasinWindow(lon,lat)
                 ncvar    = fp.variables[ncvarname]
                 FillValue = self.getFillValue(ncvar)
-                for i,date in enumerate(dates[:]):
-                    if date.year in range(self.syr,self.eyr+1):
-                       data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                       data_ba = np.ma.mean(data,axis=tuple(range(1, data.ndim)))
-                       tdata.append(self.getLayeredDepthProfile(varname,depth,data_ba))
-                fp.close()
-            pdata.data = np.ma.mean(tdata,axis=0)
+                for tslice in self.getTimeChunks(tyears,ncvar):
+                    data    = self.readBasinWindow(ncvar,tslice,window,lat.size,lon.size,zslice)
+                    yield self.maskFillValue(varname,data,FillValue), depth, zslice, lon, lat
+            finally:
+                self.closeNetCDFfilepointer(fp)
+
+    def readProfile(self):
+        """ varname is either T or S
+        Read data from a netCDF file and return its temporal mean
+        for the basin-averaged profile.
+        """
+        for varname in ['S','T']:
+            tdata = dict([(basin,Accumulator()) for basin in self.basins])
+            for data, depth, zslice, lon, lat in \
+                prefetch(self.iterYearSlabs(varname),self.prefetchdepth):
+                for basin, data_ba in self.averageBasins(data,lon,lat,varname).items():
+                    tdata[basin].add(self.getLayeredDepthProfile(varname,depth,data_ba.T,zslice).T)
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
 
     def readTransect(self,maxis=(0,2)):
         """ varname is either T or S
@@ -985,40 +1988,105 @@ class SODA331(Product):
         for the basin-averaged profile.
         """
         for varname in ['S','T']:
-            pdata = getattr(self,varname)
-            ncvarname = self.ncvarname[varname]
-            tdata = []
-            for year in range(self.syr,self.eyr+1):
-                fn = self.getNetCDFfilename(varname,year)
-                fp = self.getNetCDFfilepointer(fn)
-                lon, lat = self.readLatLon(fp)
-                dates    = self.getDates(fp,year)
-                depth    = np.array(fp.variables[self.ncdepthname])
-                basinmask= self.findBasinIndex(lon,lat)
-                ncvar    = fp.variables[ncvarname]
-                FillValue = self.getFillValue(ncvar)
-                for i,date in enumerate(dates[:]):
-                    if date.year in range(self.syr,self.eyr+1):
-                       data    = np.ma.masked_values(ncvar[i],FillValue)*basinmask
-                       tdata.append(self.getLayeredDepthProfile(varname,depth,data))
-                fp.close()
-            pdata.data = np.ma.mean(tdata,axis=maxis)
+            tdata = dict([(basin,Accumulator(maxis)) for basin in self.basins])
+            for data, depth, zslice, lon, lat in \
+                prefetch(self.iterYearSlabs(varname),self.prefetchdepth):
+                for basin in self.basins:
+                    bdata   = self.selectTransect(data,lon,lat,basin)
+                    ldata   = self.getLayeredDepthProfile(varname,depth,np.ma.swapaxes(bdata,0,1),zslice)
+                    tdata[basin].add(np.ma.swapaxes(ldata,0,1))
+            for basin in self.basins:
+                pdata = self.getProfVar(varname,basin)
+                pdata.data = tdata[basin].getMean()
+
+def loadProducts(fn):
+    """ Products rehydrated from the results store fn, see
+        Products.saveStore. No data files are read and the profile
+        arrays are loaded from the store only when accessed.
+    """
+    def asstr(v):
+        if isinstance(v,unicode):
+            return str(v)
+        return v
+    store = np.load(fn)
+    meta  = json.loads(str(store['meta']))
+    prset = Products.__new__(Products)
+    prset.syr, prset.eyr = meta['syr'], meta['eyr']
+    prset.nproc = 1
+    prset.basins = [asstr(b) for b in meta['basins']]
+    prset.title = prset.basin = prset.basins[0]
+    prset.products = []
+    for pi, pmeta in enumerate(meta['products']):
+        pobj = globals()[pmeta['cls']]
+        product = pobj.__new__(pobj)
+        product.__dict__.update(dict([(asstr(k),asstr(v)) for k, v in pmeta['attrs'].items()]))
+        product.basins = [asstr(b) for b in pmeta['basins']]
+        product.basin = product.basins[0]
+        product.bathymetries = {}
+        product.bathykeys = {}
+        product.LevelBounds = dict([(asstr(vname),np.array(lbs))\
+                                    for vname, lbs in pmeta['LevelBounds'].items()])
+        product.profvars = {}
+        for basin in product.basins:
+            product.profvars[basin] = dict([(vname,StoredProfVar(vname,product.LevelBounds[vname],\
+                                      store,'%d/%s/%s' % (pi,basin,vname))) for vname in ['T','S']])
+        product.setProfVars(product.profvars)
+        if pmeta['attr']=='products':
+            prset.products.append(product)
+        else:
+            setattr(prset,pmeta['attr'],product)
+    prset.setPlotDefaults()
+    prset.setFileOut()
+    return prset
+
+def readProduct(args):
+    """ Worker of Products.readProducts. Calls the read method of
+        a product and returns its T and S profile variables of all basins
+        and its read statistics.
+    """
+    product, method = args
+    try:
+        product.readWithStats(method)
+    except SystemExit:
+        # a worker exiting would leave the pool waiting for it
+        raise RuntimeError("Reading %s failed!" % product.dset)
+    return product.profvars, product.stats
 
 class Products(object):
     """ Container for ORA-IP products
+        With nproc>1 products are read in parallel by nproc processes.
+        basin can be a list of basins which are all read in one pass,
+        see selectBasin. An item of productobjs can be a (product class,
+        basins) pair to read the product only for those basins.
     """
     def __init__(self,productobjs,basin='Antarctic',\
-                 syr=1993,eyr=2010):
+                 syr=1993,eyr=2010,nproc=1):
         self.products = []
         self.syr, self.eyr = syr, eyr
-        self.title = self.basin = basin
+        self.nproc = nproc
+        if isinstance(basin,list):
+            self.basins = basin
+        else:
+            self.basins = [basin]
+        self.title = self.basin = self.basins[0]
         for pobj in productobjs:
-            self.products.append(pobj(basin,syr,eyr))
-        self.mmm = MultiModelMean(basin)
-        if basin not in ['Antarctic']:
-            self.sumata = Sumata(basin)
-        self.woa13 = WOA13(basin)
-        self.en4   = EN4(basin,syr,eyr)
+            if isinstance(pobj,tuple):
+                pobj, pbasins = pobj
+                pbasins = [b for b in self.basins if b in pbasins]
+            else:
+                pbasins = self.basins
+            if len(pbasins):
+                self.products.append(pobj(pbasins,syr,eyr))
+        self.mmm = MultiModelMean(self.basins)
+        sbasins = [b for b in self.basins if b not in ['Antarctic']]
+        if len(sbasins):
+            self.sumata = Sumata(sbasins)
+        self.woa13 = WOA13(self.basins)
+        self.en4   = EN4(self.basins,syr,eyr)
+        self.setPlotDefaults()
+        self.setFileOut()
+
+    def setPlotDefaults(self):
         self.xlabel = {'T':"Temperature [$^\circ$C]",\
                        'S':"Salinity [ppm]"}
         self.ylabel = "depth [m]"
@@ -1036,37 +2104,186 @@ class Products(object):
                               'ORAP5':2,'SODA3.3.1':2,'TOPAZ':2,'UoR':2,\
                               'ECDA':1,'MOVEG2i':2}
         self.pretitle = ['(a)','(b)','(c)','(d)','(e)','(f)']
+        # S and T spacing of the sigma-t contours, see calcDensityMap
+        self.densityres = 0.1
+
+    def setFileOut(self):
         modstr = '_'.join([p.dset for p in self.products])
         self.fileout = "%s_%04d-%04d_%s" % \
-                       (modstr,syr,eyr,basin)
+                       (modstr,self.syr,self.eyr,'_'.join(self.basins))
+
+    def selectBasin(self,basin):
+        """ Products of one basin of a multi-basin read for plotting.
+            Profile data is shared with this one.
+        """
+        prset = copy.copy(self)
+        prset.title = prset.basin = basin
+        prset.basins = [basin]
+        prset.products = [p.selectBasin(basin) for p in self.products if basin in p.basins]
+        prset.mmm   = self.mmm.selectBasin(basin)
+        prset.woa13 = self.woa13.selectBasin(basin)
+        prset.en4   = self.en4.selectBasin(basin)
+        if hasattr(self,'sumata') and basin in self.sumata.basins:
+            prset.sumata = self.sumata.selectBasin(basin)
+        elif hasattr(prset,'sumata'):
+            del prset.sumata
+        prset.setFileOut()
+        return prset
+
+    def getStoredProducts(self):
+        """ (attribute, product) of the products of a results store
+        """
+        pairs = [('products',product) for product in self.products]
+        for attr in ['mmm','sumata','woa13','en4']:
+            if hasattr(self,attr):
+                pairs.append((attr,getattr(self,attr)))
+        return pairs
+
+    def saveStore(self,fn):
+        """ Write the profile variables of all products and basins, and
+            the metadata to rehydrate them, to the results store fn (.npz).
+            See loadProducts.
+        """
+        arrays = {}
+        meta = {'syr':self.syr,'eyr':self.eyr,'basins':self.basins,'products':[]}
+        for pi, (attr, product) in enumerate(self.getStoredProducts()):
+            # plain attributes like dset, legend and line colors
+            attrs = dict([(k,v) for k, v in vars(product).items()\
+                          if isinstance(v,(str,int,float,bool))])
+            meta['products'].append({'attr':attr,'cls':product.__class__.__name__,\
+                                     'basins':product.basins,'attrs':attrs,\
+                                     'LevelBounds':dict([(vname,np.asarray(lbs).tolist())\
+                                     for vname, lbs in product.LevelBounds.items()])})
+            for basin in product.basins:
+                for vname in ['T','S']:
+                    arrays.update(getProfVarArrays(product.getProfVar(vname,basin),\
+                                                   '%d/%s/%s' % (pi,basin,vname)))
+        arrays['meta'] = np.array(json.dumps(meta))
+        if not saveArray(fn,arrays):
+            print "Cant write %s!" % fn
+
+    def readProducts(self,products,methods):
+        """ Call methods of products (one method per product) either
+            one after another or in a pool of nproc worker processes.
+            Workers return the T and S profile variables of each basin
+            which are gathered back to the products. Results are cached
+            per product and basin in CacheDir, only products without
+            a valid cached result are read.
+        """
+        pms = []
+        for product, method in zip(products,methods):
+            product.resetStats(method)
+            # the input files are stat'ed again for each read
+            product.filekeys = {}
+            if product.loadResults(method):
+                product.stats['cached'] = True
+            else:
+                pms.append((product,method))
+        products, methods = [p for p, m in pms], [m for p, m in pms]
+        if not len(products):
+            return
+        if self.nproc>1:
+            # workers must not inherit the open datasets
+            closeDatasets()
+            pool = multiprocessing.Pool(min(self.nproc,len(products)))
+            try:
+                results = pool.map(readProduct,zip(products,methods),chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            for product, (pvar, stats) in zip(products,results):
+                product.setProfVars(pvar)
+                product.stats = stats
+        else:
+            for product, method in zip(products,methods):
+                product.readWithStats(method)
+        for product, method in zip(products,methods):
+            product.saveResults(method)
+
+    def getReport(self,products):
+        """ Read statistics of products per product and variable,
+            see Product.resetStats. The peak RSS is that of the process
+            which read the product, workers read several products.
+        """
+        report = {'date':time.strftime('%Y-%m-%dT%H:%M:%S'),\
+                  'syr':self.syr,'eyr':self.eyr,'basins':self.basins,\
+                  'nproc':self.nproc,'products':[]}
+        for product in products:
+            pstats = dict([(k,v) for k, v in product.stats.items() if k!='vars'])
+            pstats.update({'dset':product.dset,'cls':product.__class__.__name__,\
+                           'basins':product.basins,'vars':{}})
+            for vname, vstats in product.stats['vars'].items():
+                vstats = dict(vstats)
+                vstats['files'] = len(vstats['files'])
+                pstats['vars'][vname] = vstats
+            report['products'].append(pstats)
+        return report
+
+    def writeReport(self,products,mode):
+        """ Write the read statistics of products as json and csv,
+            one csv row per product and variable, to ReportDir
+        """
+        report = self.getReport(products)
+        fn = os.path.join(ReportDir,"%s_%s" % (self.fileout,mode))
+        try:
+            if not os.path.exists(ReportDir):
+                os.makedirs(ReportDir)
+            fp = open(fn+'.json','w')
+            json.dump(report,fp,indent=1,sort_keys=True)
+            fp.close()
+            fp = open(fn+'.csv','wb')
+            columns = ['dset','cls','method','vname','cached']+StatsCounters+['wall','maxrss_kb']
+            writer = csv.writer(fp)
+            writer.writerow(columns)
+            for pstats in report['products']:
+                for vname in ['T','S']:
+                    row = dict(pstats)
+                    row.update(pstats['vars'][vname])
+                    row['vname'] = vname
+                    writer.writerow([row[c] for c in columns])
+            fp.close()
+        except (IOError,OSError):
+            print "Cant write %s!" % fn
+            return
+        print "Wrote %s.json and .csv" % fn
 
     def readProfiles(self):
         """ Reads now both T and S profiles
         """
+        products, methods = [], []
         for product in self.products:
+            products.append(product)
             if product.dset=='GECCO2':
-                product.readGECCO2Profile()
+                methods.append('readGECCO2Profile')
             else:
-                product.readProfile()
-        if self.basin not in ['Antarctic']:
-            self.sumata.readProfile()
-        self.woa13.readProfile()
-        self.en4.readProfile()
+                methods.append('readProfile')
+        if hasattr(self,'sumata'):
+            products.append(self.sumata)
+            methods.append('readProfile')
+        products += [self.woa13,self.en4]
+        methods  += ['readProfile','readProfile']
+        self.readProducts(products,methods)
+        self.writeReport(products,'profiles')
 
     def readTransects(self):
         """ Reads now both T and S transects
         """
+        products, methods = [], []
         for product in self.products:
+            products.append(product)
             if product.dset=='GECCO2':
-                product.readGECCO2Transect()
+                methods.append('readGECCO2Transect')
             else:
-                product.readTransect()
-            print product.S.data.shape
-        if self.basin not in ['Antarctic']:
-            self.sumata.readTransect()
-            print self.sumata.S.data.shape
-        self.woa13.readTransect()
-        print self.sumata.S.data.shape
+                methods.append('readTransect')
+        if hasattr(self,'sumata'):
+            products.append(self.sumata)
+            methods.append('readTransect')
+        products.append(self.woa13)
+        methods.append('readTransect')
+        self.readProducts(products,methods)
+        self.writeReport(products,'transects')
+        for product in products:
+            print product.dset, product.S.data.shape
 
     def getMultiModelMean(self,vname,maxis=(0,)):
         """ EN4 is not a part of MMM!
@@ -1091,24 +2308,16 @@ class Products(object):
         val = np.ma.max(np.ma.abs(data))
         return -1*val, val
 
-    def calcDensityMap(self):
-        # Calculate how many gridcells we need in the x and y dimensions
+    def calcDensityMap(self,resolution=None):
+        """ Salinity and temperature axes and sigma-t [t,s] covering
+            the data range with a margin, at resolution (densityres by
+            default), see calcDensityGrid
+        """
+        if resolution is None:
+            resolution = self.densityres
         tmin, tmax = self.getDataRange('T')
         smin, smax = self.getDataRange('S')
-        smin, smax, tmin, tmax = smin-0.3, smax+0.3, tmin-0.3, tmax+0.3
-        xdim = int(round((smax-smin)/0.1+1,0))
-        ydim = int(round((tmax-tmin)/0.1+1,0))
-        # Create empty grid of zeros
-        dens = np.zeros((ydim,xdim))
-        # Create temp and salt vectors of appropriate dimensions
-        ti = np.linspace(1,ydim-1,ydim)*0.1+tmin
-        si = np.linspace(1,xdim-1,xdim)*0.1+smin
-        # Loop to fill in grid with densities
-        for j in range(0,int(ydim)):
-            for i in range(0, int(xdim)):
-                dens[j,i]=dens0(si[i],ti[j])
-        # Substract 1000 to convert to sigma-t
-        return si, ti, dens - 1000
+        return calcDensityGrid(smin-0.3,smax+0.3,tmin-0.3,tmax+0.3,resolution)
 
     def plotOneNonLevAvgProfile(self,product,vname,ax):
         y = getattr(getattr(product,vname),'depth')
@@ -1417,25 +2626,24 @@ class Products(object):
         plt.savefig('./basin_avg/TS_'+self.fileout+'.pdf')
 
 if __name__ == "__main__":
-    for basin in ['Antarctic','Arctic','Eurasian','Amerasian']:
-    #for basin in ['Amerasian']:
-        if basin in ['Antarctic']:
-            prset = Products([CGLORS,ECDA,GECCO2,GloSea5,GLORYS2V4,\
-                              MOVEG2i,ORAP5,SODA331,UoR],basin)
-        else:
-            prset = Products([CGLORS,ECDA,GECCO2,GloSea5,GLORYS2V4,\
-                              MOVEG2i,ORAP5,SODA331,TOPAZ,UoR],basin)
-        #prset = Products([GloSea5],basin)
-        cpf = "oraip-ts-%s.cpickle.gz" % basin
-        if os.path.exists(cpf):
-            fp = gzip.open(cpf)
-            prset = cPickle.load(fp)
-            fp.close()
-        else:
-            prset.readProfiles()
-            fp = gzip.open(cpf,'w')
-            cPickle.dump(prset,fp)
-            fp.close()
+    basins = ['Antarctic','Arctic','Eurasian','Amerasian']
+    #basins = ['Amerasian']
+    store = "oraip-ts-%s.npz" % '_'.join(basins)
+    if '--plot-only' in sys.argv and os.path.exists(store):
+        prsets = loadProducts(store)
+    else:
+        if '--refresh-catalog' in sys.argv:
+            getCatalog(DataPath,refresh=True,cachedir=CacheDir)
+        # all basins are read in one pass, TOPAZ covers only the Arctic
+        prsets = Products([CGLORS,ECDA,GECCO2,GloSea5,GLORYS2V4,\
+                           MOVEG2i,ORAP5,SODA331,\
+                           (TOPAZ,['Arctic','Eurasian','Amerasian']),UoR],basins)
+        #prsets = Products([GloSea5],basins)
+        # results are cached per product in CacheDir
+        prsets.readProfiles()
+        prsets.saveStore(store)
+    for basin in basins:
+        prset = prsets.selectBasin(basin)
         for vname in ['T','S']:
             prset.getMultiModelMean(vname)
             #prset.plotDepthProfile(vname)
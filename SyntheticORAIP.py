@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Synthetic ORA-IP input files for timing and regression testing the
+readers of PORAIPHydrography without the real archive.
+The files reproduce the file names, variable names, time units and
+grids of each product on the 1 deg grid (r360x180) which the readers
+assume. The size sets the number of years and the model levels.
+"""
+
+import os
+import sys
+import datetime
+import numpy as np
+import netCDF4 as nc
+
+# 1 deg grid of the ORA-IP products, lons are 0..360 or -180..180
+Lat  = np.arange(-89.5,90.,1.)
+Lon  = np.arange(0.5,360.,1.)
+LonW = np.arange(-179.5,180.,1.)
+# WOA13 standard depths indexed by the Bottom_Standard_Level of the landsea mask
+WOA13Depths = range(0,105,5)+range(125,525,25)+range(550,2050,50)+range(2100,9200,100)
+# cumulative integral depths of the annual mean products
+IntegralDepths = [100,300,700,1500,3000]
+# number of years and model levels of the 3D products per size
+Sizes = {'small':{'nyears':2,'nz':15},\
+         'medium':{'nyears':5,'nz':33},\
+         'large':{'nyears':10,'nz':50}}
+
+def getLevels(nz):
+    """ nz model levels from 5 m to 5500 m, finer near the surface
+    """
+    return np.round(5.+5495.*np.linspace(0.,1.,nz)**2,1)
+
+def getLandMask(lat,lon):
+    y, x = np.meshgrid(lat,lon,indexing='ij')
+    return np.abs(np.sin(np.deg2rad(3*x))*np.cos(np.deg2rad(2*y)))>0.9
+
+def getProfile(vname,z,lat):
+    """ T or S at depths z and lats, warm and fresh near the surface
+    """
+    if vname=='T':
+        return 4.*np.exp(-z/500.)*np.cos(np.deg2rad(lat))-1.5
+    return 35.-2.*np.exp(-z/300.)*np.abs(np.sin(np.deg2rad(lat)))
+
+class Generator(object):
+    """ Writes the synthetic files of all products under root
+    """
+    def __init__(self,root,syr=1993,eyr=1994,nz=15,seed=1):
+        self.root = root
+        self.syr, self.eyr = syr, eyr
+        self.years = range(syr,eyr+1)
+        self.depth = getLevels(nz)
+        self.rs = np.random.RandomState(seed)
+
+    def getField(self,vname,z,lat,lon,t=0.):
+        """ [z,y,x] field with a lon dependence, a trend and noise
+        """
+        y, x = np.meshgrid(lat,lon,indexing='ij')
+        data = getProfile(vname,np.asarray(z)[:,None,None],y[None])+\
+               0.2*np.sin(np.deg2rad(x))[None]+0.01*t
+        return data+0.05*self.rs.randn(*data.shape)
+
+    def getIntegral(self,vname,dpth,lat,lon,t=0.):
+        """ 0-dpth m integral [y,x] of the field
+        """
+        zz = np.linspace(0.,dpth,21)
+        return self.getField(vname,0.5*(zz[1:]+zz[:-1]),lat,lon,t).mean(axis=0)*dpth
+
+    def createFile(self,fn,dims):
+        fn = os.path.join(self.root,fn)
+        dn = os.path.dirname(fn)
+        if not os.path.exists(dn):
+            os.makedirs(dn)
+        fp = nc.Dataset(fn,'w')
+        for dname, size in dims:
+            fp.createDimension(dname,size)
+        return fp
+
+    def createTime(self,fp,tname,values,units,calendar=None):
+        time = fp.createVariable(tname,'f8',(tname,))
+        time.units = units
+        if calendar is not None:
+            time.calendar = calendar
+        time[:] = values
+        return time
+
+    def getAnnualTimes(self,years,units,calendar='standard'):
+        return nc.date2num([datetime.datetime(year,7,1) for year in years],units,calendar)
+
+    def writeIntegral(self,fn,ncvarnames,vname,lat=Lat,lon=Lon,tname='time',\
+                      units='days since 1900-01-01',calendar='standard',zdim=False):
+        """ Annual means of the 0-X m integrals, ncvarnames {X: name},
+            X is the depth or 'bot'
+        """
+        dims = [(tname,None),('lat',len(lat)),('lon',len(lon))]
+        if zdim:
+            dims.insert(1,('z',1))
+        fp = self.createFile(fn,dims)
+        fp.createVariable('lat','f4',('lat',))[:] = lat
+        fp.createVariable('lon','f4',('lon',))[:] = lon
+        if units.startswith('months'):
+            year0 = int(units.split()[2][:4])
+            self.createTime(fp,tname,[(year-year0)*12+6 for year in self.years],units)
+        else:
+            self.createTime(fp,tname,self.getAnnualTimes(self.years,units,calendar),units,calendar)
+        landmask = getLandMask(lat,lon)
+        for dpth, ncvarname in sorted(ncvarnames.items()):
+            ncvar = fp.createVariable(ncvarname,'f4',tuple([d for d, n in dims]),fill_value=-9999.)
+            for i, year in enumerate(self.years):
+                idpth = 5000 if dpth=='bot' else dpth
+                data = np.ma.array(self.getIntegral(vname,idpth,lat,lon,year-1990),mask=landmask)
+                if zdim:
+                    ncvar[i,0] = data
+                else:
+                    ncvar[i] = data
+        fp.close()
+
+    def write3D(self,fn,ncvarname,vname,ntime=None,latname='lat',lonname='lon',\
+                depthname='depth',tname=None,units=None,t0=0,lon=Lon,fill=1e20):
+        """ [t,z,y,x] model level fields of ntime monthly records,
+            or one [z,y,x] field if tname is None
+        """
+        dims = [(depthname,len(self.depth)),(latname,len(Lat)),(lonname,len(lon))]
+        if tname is not None:
+            dims.insert(0,(tname,ntime))
+        fp = self.createFile(fn,dims)
+        fp.createVariable(latname,'f4',(latname,))[:] = Lat
+        fp.createVariable(lonname,'f4',(lonname,))[:] = lon
+        fp.createVariable(depthname,'f4',(depthname,))[:] = self.depth
+        if tname is not None:
+            self.createTime(fp,tname,np.arange(ntime)+t0,units)
+        ncvar = fp.createVariable(ncvarname,'f4',tuple([d for d, n in dims]),fill_value=fill)
+        mask = np.broadcast_to(getLandMask(Lat,lon),(len(self.depth),len(Lat),len(lon)))
+        if tname is None:
+            ncvar[:] = np.ma.array(self.getField(vname,self.depth,Lat,lon,t0/12.),mask=mask)
+        else:
+            for i in range(ntime):
+                ncvar[i] = np.ma.array(self.getField(vname,self.depth,Lat,lon,(t0+i)/12.),mask=mask)
+        fp.close()
+
+    def writeIntegralProducts(self):
+        """ UoR, ECDA, GloSea5, MOVEG2, GECCO2 temperature and EN4
+        """
+        for vname, lname in [('T','temperature'),('S','salinity')]:
+            ncvarname = 'vertically_integrated_%s' % lname
+            for dpth in IntegralDepths:
+                ncvarnames = {dpth:ncvarname}
+                self.writeIntegral("UoR_int%s_annmean_1989to2010_0-%dm_r360x180.nc" % (vname,dpth),\
+                                   ncvarnames,vname)
+                self.writeIntegral("ECDA_int%s_annmean_1993to2011_0-%dm_r360x180.nc" % (vname,dpth),\
+                                   ncvarnames,vname,tname='TIME')
+                self.writeIntegral("GloSea5_GO5_int%s_annmean_1993to2014_0-%dm_r360x180.nc" % (vname,dpth),\
+                                   ncvarnames,vname,tname='time_counter',calendar='360_day')
+                if vname=='T':
+                    self.writeIntegral("MOVEG2_int%s_annmean_1993to2012_0-%dm_r360x180.nc" % (vname,dpth),\
+                                       ncvarnames,vname)
+                    self.writeIntegral("GECCO2_int%s_annmean_1948to2012_0-%dm_r360x180.nc" % (vname,dpth),\
+                                       ncvarnames,vname)
+                else:
+                    # MOVEG2 salinity has months since units and a z dimension
+                    self.writeIntegral("MOVEG2_int%s_annmean_1993to2012_0-%dm_r360x180.nc" % (vname,dpth),\
+                                       ncvarnames,vname,units='months since 1993-01-15',\
+                                       calendar=None,zdim=True)
+                # EN4 lats start from 82.5S
+                self.writeIntegral("EN4.2.0.g10_int%s_annmean_1950to2015_0-%dm.nc" % (vname,dpth),\
+                                   {dpth:'%s_int_%d' % (vname.lower(),dpth)},vname,lat=Lat[7:])
+
+    def writeGECCO2Salinity(self):
+        """ Layer mean salinities S_0_X of all years from 1948 on,
+            lons are -180..180
+        """
+        years = range(1948,self.eyr+1)
+        fp = self.createFile('GECCO2_intS_annmean_1948to2011_all_layers_r360x180.nc',\
+                             [('time',len(years)),('lat',len(Lat)),('lon',len(LonW))])
+        fp.createVariable('lat','f4',('lat',))[:] = Lat
+        fp.createVariable('lon','f4',('lon',))[:] = LonW
+        fp.createVariable('time','f8',('time',))[:] = np.arange(len(years))
+        landmask = getLandMask(Lat,LonW)
+        for dpth in IntegralDepths+[4000]:
+            ncvar = fp.createVariable('S_0_%d' % dpth,'f4',('time','lat','lon'),fill_value=-1e34)
+            for i, year in enumerate(years):
+                ncvar[i] = np.ma.array(self.getIntegral('S',dpth,Lat,LonW,year-1990)/dpth,mask=landmask)
+        fp.close()
+
+    def writeGLORYS(self):
+        for vname, cname, hs in [('T','HC','heat'),('S','SC','salt')]:
+            fn = 'GSOP_GLORYS2V4_ORCA025_%s.nc' % cname
+            ncvarnames = dict([(dpth,'z%d%sc' % (dpth,hs)) for dpth in [10,100,300,700,1500,3000,4000]])
+            ncvarnames['bot'] = 'zbot%sc' % hs
+            self.writeIntegral(fn,ncvarnames,vname,units='days since 1950-01-01 00:00:00',\
+                               calendar='gregorian')
+
+    def write3DProducts(self):
+        """ TOPAZ monthly files, CGLORS and SODA3.3.1 yearly files,
+            ORAP5 and MOVEG2i files of all months
+        """
+        for year in self.years:
+            for month in range(1,13):
+                t0 = (year-1990)*12+month
+                self.write3D("TP4_r360x180_temp_%04d_%02d.nc" % (year,month),'temperature','T',\
+                             latname='latitude',lonname='longitude',t0=t0)
+                self.write3D("TP4_r360x180_salt_%04d_%02d.nc" % (year,month),'salinity','S',\
+                             latname='latitude',lonname='longitude',t0=t0)
+            # CGLORS has the WOA grid and deptht until 1992 and in 2010 for T
+            for vname, ncvarname in [('T','votemper'),('S','vosaline')]:
+                if year<1993 or (vname=='T' and year==2010):
+                    grid, depthname = 'WOA', 'deptht'
+                else:
+                    grid, depthname = '1x1', 'dep'
+                self.write3D('CGLORS025v5/%s_ORCA025-%s_%d.nc' % (ncvarname,grid,year),ncvarname,vname,\
+                             12,depthname=depthname,tname='time_counter',units='months')
+            self.write3D('temperature3D_SODA3.3.1/temperature3D_SODA_3_3_1_%d.nc' % year,'temp','T',12,\
+                         latname='latitude',lonname='longitude',tname='time',units='months')
+            self.write3D('salinity3D_SODA3.3.1/salinity3D_SODA_3_3_1_%d.nc' % year,'salt','S',12,\
+                         latname='latitude',lonname='longitude',tname='time',units='months')
+        ntime = 12*len(self.years)
+        t0 = 12*(self.syr-1993)
+        self.write3D('temperature3D_orap5_1m_1993-2012_r360x180.nc','votemper','T',ntime,\
+                     depthname='deptht',tname='time_counter',units='months since 1993-01-15',t0=t0)
+        self.write3D('salinity3D_orap5_1m_1993-2012_r360x180.nc','vosaline','S',ntime,\
+                     depthname='deptht',tname='time_counter',units='months since 1993-01-15',t0=t0)
+        t0 = 12*(self.syr-1980)
+        self.write3D('MOVEG2i_temp3d_1980-2012.nc','temp','T',ntime,\
+                     depthname='level',tname='time',units='month since 1980-01-15',t0=t0)
+        self.write3D('MOVEG2i_sal3d_1980-2012.nc','sal','S',ntime,\
+                     depthname='level',tname='time',units='month since 1980-01-15',t0=t0)
+
+    def writeClimatologies(self):
+        """ Seasonal Sumata and WOA13 climatologies, lons are -180..180
+        """
+        for fn in ['ts-clim/hiroshis-clim/archive_v12_QC2_3_DPL_checked_2d_season_all-remapbil-oraip.nc',\
+                   'ts-clim/hiroshis-clim/archive_v12_QC2_3_DPL_checked_2d_season_int-remapbil-oraip.nc',\
+                   'ts-clim/woa13/woa13-clim-1995-2012-season.nc']:
+            fp = self.createFile(fn,[('time',4),('depth',len(self.depth)),\
+                                     ('lat',len(Lat)),('lon',len(LonW))])
+            fp.createVariable('lat','f4',('lat',))[:] = Lat
+            fp.createVariable('lon','f4',('lon',))[:] = LonW
+            fp.createVariable('depth','f4',('depth',))[:] = self.depth
+            mask = np.broadcast_to(getLandMask(Lat,LonW),(len(self.depth),len(Lat),len(LonW)))
+            for vname, ncvarname in [('T','temperature'),('S','salinity')]:
+                ncvar = fp.createVariable(ncvarname,'f4',('time','depth','lat','lon'),fill_value=-999.)
+                for i in range(4):
+                    ncvar[i] = np.ma.array(self.getField(vname,self.depth,Lat,LonW,i),mask=mask)
+            fp.close()
+
+    def writeBathymetry(self,fn='landsea_01.msk'):
+        """ WOA13 landsea mask, land where the fields are masked
+        """
+        y, x = np.meshgrid(Lat,LonW,indexing='ij')
+        levels = np.clip(60+40*np.cos(np.deg2rad(x))*np.cos(np.deg2rad(2*y)),1,len(WOA13Depths)).astype(int)
+        levels[getLandMask(Lat,LonW)] = 1
+        fp = open(os.path.join(self.root,fn),'w')
+        fp.write('#WOA13 landsea mask\nLatitude,Longitude,Bottom_Standard_Level\n')
+        for yy, xx, level in zip(y.ravel(),x.ravel(),levels.ravel()):
+            fp.write('%.1f,%.1f,%d\n' % (yy,xx,level))
+        fp.close()
+
+    def writeAll(self):
+        print "Writing synthetic ORA-IP files of %d-%d to %s" % (self.syr,self.eyr,self.root)
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.writeBathymetry()
+        self.writeIntegralProducts()
+        self.writeGECCO2Salinity()
+        self.writeGLORYS()
+        self.write3DProducts()
+        self.writeClimatologies()
+
+def generate(root,size='small',syr=1993):
+    """ Write the synthetic files of size (see Sizes) from syr on
+    """
+    nyears, nz = Sizes[size]['nyears'], Sizes[size]['nz']
+    Generator(root,syr,syr+nyears-1,nz).writeAll()
+
+if __name__ == "__main__":
+    if len(sys.argv)<2:
+        print "Usage: %s root [%s] [syr]" % (sys.argv[0],'|'.join(sorted(Sizes)))
+        sys.exit(1)
+    root = sys.argv[1]
+    size = sys.argv[2] if len(sys.argv)>2 else 'small'
+    syr  = int(sys.argv[3]) if len(sys.argv)>3 else 1993
+    generate(root,size,syr)
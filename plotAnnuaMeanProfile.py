@@ -8,7 +8,6 @@ import os
 import sys
 import re
 import copy
-import glob
 import string
 import numpy as np
 import matplotlib as mpl
@@ -17,6 +16,7 @@ import netCDF4 as nc
 from datetime import datetime
 from netcdftime import utime
 from seawater import dens0
+from ORAIPCatalog import getCatalog
 
 # Global variables
 Alphabets = list(string.ascii_lowercase)
@@ -60,6 +60,97 @@ ModelLineColors = {"GECCO2":"darkred",\
 # Models without sea ice: SODA
 # Not a model: EN3
 
+# largest lat-lon box read at once by readPoints, larger boxes are read by rows
+MaxPointBox = 1000000
+
+# The profile classes take either one point (plon, plat) or arrays
+# of N points whose profiles are all extracted from the same reads.
+# Their data is then [layer,point], see splitPoints.
+
+def getNearestIndex(axis,points):
+    """ Index of the value of axis nearest to each of points
+    """
+    axis = np.asarray(axis)
+    dist = np.abs(axis[np.newaxis,:]-np.atleast_1d(points)[:,np.newaxis])
+    return np.argmin(dist,axis=1)
+
+def getPointIndices(lon,lat,plon,plat):
+    """ Grid indices iy, ix nearest to the points plon, plat
+    """
+    return getNearestIndex(lat,plat), getNearestIndex(lon,plon)
+
+def readPoints(ncvar,index,iy,ix,dtype=None):
+    """ ncvar[index+(...,iy[i],ix[i])] of each point i as [...,point].
+        The box enclosing the points is read in one call and the points
+        are picked from it, or the box is read row by row if it has
+        more than MaxPointBox cells.
+        dtype is e.g. float for differences of integrals.
+    """
+    iy, ix = np.atleast_1d(iy), np.atleast_1d(ix)
+    y0, x0 = iy.min(), ix.min()
+    y1, x1 = iy.max()+1, ix.max()+1
+    if (y1-y0)*(x1-x0)<=MaxPointBox:
+        data = np.ma.array(ncvar[index+(Ellipsis,slice(y0,y1),slice(x0,x1))])
+        return np.ma.array(data[...,iy-y0,ix-x0],dtype=dtype)
+    uy, jy = np.unique(iy,return_inverse=True)
+    pieces, order = [], []
+    for k, y in enumerate(uy):
+        pnts = np.where(jy==k)[0]
+        px = ix[pnts]
+        row = np.ma.array(ncvar[index+(Ellipsis,y,slice(px.min(),px.max()+1))])
+        pieces.append(row[...,px-px.min()])
+        order.append(pnts)
+    data = np.ma.concatenate(pieces,axis=-1)
+    return np.ma.array(data[...,np.argsort(np.hstack(order))],dtype=dtype)
+
+def readPointSeries(ncvar,index,records,iy,ix,dtype=None):
+    """ readPoints of the records along the first dimension of ncvar,
+        [record,...,point], from one read of the slab spanning them.
+        index selects the dimensions between time and lat.
+    """
+    records = np.asarray(records,dtype=int)
+    t0, t1 = (records[0], records[-1]+1) if len(records) else (0, 0)
+    data = readPoints(ncvar,(slice(t0,t1),)+index,iy,ix,dtype)
+    return data[records-t0]
+
+def getLayerMeans(depth,data,level_bounds):
+    """ Means of data [z,point] over the levels at depth within
+        each of level_bounds, [layer,point]
+    """
+    data = np.ma.array(data)
+    return np.ma.array([np.ma.mean(data[np.where((depth>=lb[0])&(depth<lb[1]))],axis=0)\
+                        for lb in level_bounds])
+
+def fixBottomSalinity(data):
+    """ Lowest two layers of the salinity profiles data [layer,point]
+        made no fresher than the layers above them
+    """
+    fix = np.ma.filled(data[-1]<data[-2],False)
+    data[-1] = np.ma.where(fix,data[-2],data[-1])
+    fix = np.ma.filled(data[-2]<data[-3],False)
+    data[-1] = np.ma.where(fix,data[-3],data[-1])
+    data[-2] = np.ma.where(fix,data[-3],data[-2])
+    return data
+
+def getPointData(data,plon):
+    """ data [...,point], as [...] of the only point if plon is a scalar
+    """
+    if np.ndim(plon)==0:
+        return data[...,0]
+    return data
+
+def splitPoints(profile):
+    """ Single point profiles of a profile of several points,
+            e.g. for Experiments
+    """
+    profiles = []
+    for i, (plon, plat) in enumerate(zip(profile.lon,profile.lat)):
+        pprofile = copy.copy(profile)
+        pprofile.lon, pprofile.lat = plon, plat
+        pprofile.data = profile.data[...,i]
+        profiles.append(pprofile)
+    return profiles
+
 class WOA13profile(object):
     """ WOA13 decadal means in 1 deg grid.
     """
@@ -87,22 +178,18 @@ class WOA13profile(object):
         fp = nc.Dataset(fn)
         depth = np.array(fp.variables['depth'][:])
         lat = np.array(fp.variables['lat'][:])
-        iy = np.where(np.abs(lat-plat)==np.min(np.abs(lat-plat)))[0][0]
         lon = np.array(fp.variables['lon'][:])
         # transfer negative lons to positive
         lon[np.where(lon<0.)] += 360.
-        ix = np.where(np.abs(lon-plon)==np.min(np.abs(lon-plon)))[0][0]
+        iy, ix = getPointIndices(lon,lat,plon,plat)
         time = np.array(fp.variables['time'][:])+1
         for t in time:
             if t in months:
-                data.append(fp.variables[ncname][t-1,:,iy,ix])
+                data.append(readPoints(fp.variables[ncname],(t-1,slice(None)),iy,ix)) # [z,point]
         fp.close()
         tavg_data = np.ma.average(data,axis=0)
         # vertical layer averaging
-        self.data = []
-        for lb in self.level_bounds:
-            iz = np.where((depth>=lb[0])&(depth<lb[1]))
-            self.data.append(tavg_data[iz].mean())
+        self.data = getPointData(getLayerMeans(depth,tavg_data,self.level_bounds),plon)
         self.depth = np.hstack((self.level_bounds[:,0],4000))
 
 class ORAIPprofile(object):
@@ -119,15 +206,18 @@ class ORAIPprofile(object):
             self.dset = dset = 'EN4.2.0.g10'
         self.vname = vname # T or S
         self.path = path
+        self.catalog = getCatalog(path)
         self.lat = plat
         self.lon = plon
         self.syr = syr
         self.eyr = eyr
         self.level_bounds = LevelBounds[vname]
         self.depth = np.hstack((self.level_bounds[:,0],4000))
+        # point time series [t,...,point] read per file, see readOneFile
+        self.series = {}
         if self.dset in ['GECCO2'] and vname=='S':
             #self.data = np.ma.masked_less_equal(self.readGECCO2salinity(),32)
-            self.data = self.readGECCO2salinity()
+            self.data = getPointData(self.readGECCO2salinity(),plon)
             return
         if vname=='T':
             self.ncname = 'vertically_integrated_temperature'
@@ -138,45 +228,38 @@ class ORAIPprofile(object):
             sys.exit(1)
         data = [[] for i in self.level_bounds[:,0]]
         for li, lb in enumerate(self.level_bounds):
-            fns = glob.glob(os.path.join(path,"%s_int%s_annmean_????to????_%d-%dm_r360x180.nc" % \
-                                              (dset,vname,lb[0],lb[1])))
-            if len(fns) and os.path.exists(fns[0]):
+            fns = self.catalog.findIntegralFiles(dset,vname,"%d-%dm" % (lb[0],lb[1]))
+            if len(fns):
                 ldata = self.readOneFile(fns[0],lb)
             else:
                 # level is missing, need to calculate it from two other
                 # levels. E.g. 100-300m is 0-300m minus 0-100m
-                fn = glob.glob(os.path.join(path,"%s_int%s_annmean_????to????_%d-%dm_r360x180.nc" % \
-                                                 (dset,vname,0,lb[0])))[0]
+                fn = self.catalog.findIntegralFiles(dset,vname,"%d-%dm" % (0,lb[0]))[0]
                 ldatau = self.readOneFile(fn,[0,lb[0]])
                 if dset in ['GloSea5_GO5'] and lb[1] in [6000]:
                     if vname=='S':
-                        fns = glob.glob(os.path.join(path,"%s_int%s_annmean_????to????_%d-%s_r360x180.nc" % \
-                                                         (dset,vname,0,'bottom')))
+                        fns = self.catalog.findIntegralFiles(dset,vname,"%d-%s" % (0,'bottom'))
                     else:
                         lb[1] = 4000.
-                        fns = glob.glob(os.path.join(path,"%s_int%s_annmean_????to????_%d-%d_r360x180.nc" % \
-                                                         (dset,vname,0,lb[1])))
+                        fns = self.catalog.findIntegralFiles(dset,vname,"%d-%d" % (0,lb[1]))
                 elif dset in ['EN4.2.0.g10'] and lb[1] in [6000]:
-                    fns = glob.glob(os.path.join(path,"%s_int%s_annmean_????to????_%s_r360x180.nc" % \
-                                                     (dset,vname,'full')))
+                    fns = self.catalog.findIntegralFiles(dset,vname,'full')
                 else:
-                    fns = glob.glob(os.path.join(path,"%s_int%s_annmean_????to????_%d-%dm_r360x180.nc" % \
-                                                     (dset,vname,0,lb[1])))
-                if len(fns) and os.path.exists(fns[0]):
+                    fns = self.catalog.findIntegralFiles(dset,vname,"%d-%dm" % (0,lb[1]))
+                if len(fns):
                     ldatal = self.readOneFile(fns[0],[0,lb[1]])
                     ldata = ldatal - ldatau
                 else:
                     ldata = np.zeros(ldatau.shape)
-            data[li].append(ldata/np.diff(self.level_bounds)[li])
+            data[li] = ldata/np.diff(self.level_bounds)[li]
         #if vname=='T':
         #if self.dset in ['EN4.2.0.g10'] and vname=='T':
         #    self.data = np.ma.masked_equal(np.ma.squeeze(data),0)-273.15
         #else:
-        self.data = np.ma.masked_equal(np.ma.squeeze(data),0)
-        if vname=='S' and self.data[-1]<self.data[-2]:
-            self.data[-1] = self.data[-2]
-        if vname=='S' and self.data[-2]<self.data[-3]:
-            self.data[-1] = self.data[-2] = self.data[-3]
+        self.data = np.ma.masked_equal(np.ma.array(data),0) # [layer,point]
+        if vname=='S':
+            self.data = fixBottomSalinity(self.data)
+        self.data = getPointData(self.data,plon)
         #else: #S
             #self.data = np.ma.masked_less_equal(np.ma.squeeze(data),32)
         #    self.data = np.ma.squeeze(data)
@@ -188,16 +271,15 @@ class ORAIPprofile(object):
         """
         fn = "%s_int%s_annmean_%04dto%04d_all_layers_r360x180.nc" % \
                (self.dset,self.vname,dsyr,deyr)
-        fp = nc.Dataset(os.path.join(self.path,fn))
+        fp = nc.Dataset(self.catalog.getPath(fn))
         print "Reading %s." % fn
         lat = np.array(fp.variables['lat'][:])
-        iy = np.where(np.abs(lat-self.lat)==np.min(np.abs(lat-self.lat)))[0][0]
         lon = np.array(fp.variables['lon'][:])
         # transfer negative lons to positive
         lon[np.where(lon<0.)] += 360.
-        ix = np.where(np.abs(lon-self.lon)==np.min(np.abs(lon-self.lon)))[0][0]
-        years = np.arange(dsyr,deyr+1)
-        time = fp.variables['time']
+        iy, ix = getPointIndices(lon,lat,self.lon,self.lat)
+        years = np.arange(dsyr,deyr+1)[:len(fp.variables['time'])]
+        records = np.where((years>=self.syr)&(years<=self.eyr))[0]
         # as 0-10m is missing, assume it is the same than 0-100m
         # values are level means NOT level integrals!
         # also assuming that S_K in the netcdf file is the mean salinity from
@@ -205,24 +287,18 @@ class ORAIPprofile(object):
         ncnames = ['S_0_100','S_0_100','S_0_300','S_0_700','S_0_1500','S_0_3000','S_0_4000']
         # level thicknesses
         zdpths = [100,100,300,700,1500,3000,4000]
-        data, zdata = [], []
-        for i,t in enumerate(time[:]):
-            year = years[i]
-            if year in range(self.syr,self.eyr+1):
-                zdata.append(np.ma.array(fp.variables[ncnames[0]][i,iy,ix]))
-        data.append(np.ma.mean(zdata)) # 0-100m
-        data.append(np.ma.mean(zdata)) # 0-100m
-        for li,ncname in enumerate(ncnames[2:]):
-            zdata = []
-            for i,t in enumerate(time[:]):
-                year = years[i]
-                if year in range(self.syr,self.eyr+1):
-                    zdatal = np.ma.array(fp.variables[ncname][i,iy,ix])*zdpths[li+2]
-                    zdatau = np.ma.array(fp.variables[ncnames[li+1]][i,iy,ix])*zdpths[li+1]
-                    zdata.append((zdatal - zdatau)/(zdpths[li+2]-zdpths[li+1]))
-            data.append(np.ma.mean(zdata))
+        # each variable is read once as [year,point]
+        zdata = dict([(ncname,readPointSeries(fp.variables[ncname],(),records,iy,ix,float))\
+                      for ncname in set(ncnames)])
         fp.close()
-        return np.ma.array(data)
+        data = []
+        data.append(np.ma.mean(zdata[ncnames[0]],axis=0)) # 0-100m
+        data.append(np.ma.mean(zdata[ncnames[0]],axis=0)) # 0-100m
+        for li,ncname in enumerate(ncnames[2:]):
+            zdatal = zdata[ncname]*zdpths[li+2]
+            zdatau = zdata[ncnames[li+1]]*zdpths[li+1]
+            data.append(np.ma.mean((zdatal - zdatau)/(zdpths[li+2]-zdpths[li+1]),axis=0))
+        return np.ma.array(data) # [layer,point]
 
     def readOneFile(self,fn,lb):
         #fpat = ".+/%s_int%s_annmean_(\d+)to(\d+)_%d-%dm_r360x180.nc" % \
@@ -231,6 +307,9 @@ class ORAIPprofile(object):
         #       (self.dset,self.vname,lb[0])
         fpat = ".+/%s_int%s_annmean_(\d+)to(\d+)_.+_r360x180.nc" % \
                (self.dset,self.vname)
+        if fn in self.series:
+            # e.g. 0-300m is both the lower and the upper bound of layers
+            return np.ma.mean(self.series[fn],axis=0)
         m = re.match(fpat,fn)
         dsyr, deyr = [int(i) for i in m.groups()]
         fp = nc.Dataset(fn)
@@ -241,7 +320,6 @@ class ORAIPprofile(object):
             lat = np.array(fp.variables['lat'][:])
         else:
             lat = np.arange(-89.5,90.)
-        iy = np.where(np.abs(lat-self.lat)==np.min(np.abs(lat-self.lat)))[0][0]
         if fp.variables.has_key('longitude'):
             lon = np.array(fp.variables['longitude'][:])
         elif fp.variables.has_key('lon'):
@@ -250,7 +328,7 @@ class ORAIPprofile(object):
             lon = np.arange(.5,360.)
         # transfer negative lons to positive
         lon[np.where(lon<0.)] += 360.
-        ix = np.where(np.abs(lon-self.lon)==np.min(np.abs(lon-self.lon)))[0][0]
+        iy, ix = getPointIndices(lon,lat,self.lon,self.lat)
         if fp.variables.has_key('TIME'):
             time = fp.variables['TIME']
         elif fp.variables.has_key('time_counter'):
@@ -272,23 +350,24 @@ class ORAIPprofile(object):
             else:
                 cdftime = utime(time.units)
             dates = [cdftime.num2date(t) for t in time[:]]
-        ldata = []
         if not fp.variables.has_key(self.ncname):
             """ EN4 has t|s_int_depth variable
             """
             self.ncname = [k for k in fp.variables.keys() if \
                            re.match("%s_int_" % (self.vname.lower()),k)][0]
             #               re.match("%s_int_\d+" % (self.vname.lower()),k)][0]
-        for i,t in enumerate(time[:]):
-            date = dates[i]
-            if date.year in range(self.syr,self.eyr+1):
-                if self.dset in ['K7ODA'] or \
-                  (self.dset in ['MOVEG2'] and self.vname=='S'):
-                    ldata.append(np.ma.array(fp.variables[self.ncname][i,:,iy,ix]).squeeze())
-                else:
-                    ldata.append(np.ma.array(fp.variables[self.ncname][i,iy,ix]))
+        years = np.array([date.year for date in dates])
+        records = np.where((years>=self.syr)&(years<=self.eyr))[0]
+        if self.dset in ['K7ODA'] or \
+          (self.dset in ['MOVEG2'] and self.vname=='S'):
+            index = (slice(None),)
+        else:
+            index = ()
+        ldata = readPointSeries(fp.variables[self.ncname],index,records,iy,ix)
         fp.close()
-        return np.ma.mean(np.ma.array(ldata))
+        # time series with the singleton level of K7ODA and MOVEG2 S
+        self.series[fn] = np.ma.reshape(ldata,(-1,ldata.shape[-1])) # [t,point]
+        return np.ma.mean(self.series[fn],axis=0) # [point]
 
 class TOPAZprofile(object):
     """ TP4 annual means in 1 deg grid.
@@ -308,35 +387,32 @@ class TOPAZprofile(object):
             fvarstr = 'salt'
             self.ncname = 'salinity'
         self.path = path
+        self.catalog = getCatalog(path)
         self.lat = plat
         self.lon = plon
         self.syr = syr
         self.eyr = eyr
         self.level_bounds = LevelBounds[vname]
         fn = "%s_r360x180_%s_%04d_%02d.nc" % (self.dset,fvarstr,syr,1)
-        fp = nc.Dataset(os.path.join(self.path,fn))
+        fp = nc.Dataset(self.catalog.getPath(fn))
         depth = np.array(fp.variables['depth'][:])
         lat = np.array(fp.variables['latitude'][:])
         lon = np.array(fp.variables['longitude'][:])
         fp.close()
         # transfer negative lons to positive
         lon[np.where(lon<0.)] += 360.
-        iy = np.where(np.abs(lat-self.lat)==np.min(np.abs(lat-self.lat)))[0][0]
-        ix = np.where(np.abs(lon-self.lon)==np.min(np.abs(lon-self.lon)))[0][0]
+        iy, ix = getPointIndices(lon,lat,self.lon,self.lat)
         self.months = range(1,13)
         years = range(syr,eyr+1)
         ldata = []
         for y in years:
             for m in self.months:
                 fn = "%s_r360x180_%s_%04d_%02d.nc" % (self.dset,fvarstr,y,m)
-                fp = nc.Dataset(os.path.join(self.path,fn))
-                ldata.append(np.ma.array(fp.variables[self.ncname][:,iy,ix])) # depth, lat, lon
+                fp = nc.Dataset(self.catalog.getPath(fn))
+                ldata.append(readPoints(fp.variables[self.ncname],(slice(None),),iy,ix)) # depth, point
                 fp.close()
         tavg_data = np.ma.mean(ldata,axis=0)
-        self.data = []
-        for lb in self.level_bounds:
-            iz = np.where((depth>=lb[0])&(depth<lb[1]))
-            self.data.append(tavg_data[iz].mean())
+        self.data = getPointData(getLayerMeans(depth,tavg_data,self.level_bounds),plon)
         self.depth = np.hstack((self.level_bounds[:,0],4000))
 
 class ORAP5profile(object):
@@ -351,6 +427,7 @@ class ORAP5profile(object):
         self.dset = dset
         self.vname = vname # T or S
         self.path = path
+        self.catalog = getCatalog(path)
         self.lat = plat
         self.lon = plon
         self.syr = syr
@@ -363,14 +440,13 @@ class ORAP5profile(object):
             fvarstr = 'salinity'
             self.ncname = 'vosaline'
         fn = "%s3D_%s_1m_1993-2012_r360x180.nc" % (fvarstr,self.dset.lower())
-        fp = nc.Dataset(os.path.join(self.path,fn))
+        fp = nc.Dataset(self.catalog.getPath(fn))
         depth = np.array(fp.variables['deptht'][:])
         lat = np.array(fp.variables['lat'][:])
         lon = np.array(fp.variables['lon'][:])
         # transfer negative lons to positive
         lon[np.where(lon<0.)] += 360.
-        iy = np.where(np.abs(lat-self.lat)==np.min(np.abs(lat-self.lat)))[0][0]
-        ix = np.where(np.abs(lon-self.lon)==np.min(np.abs(lon-self.lon)))[0][0]
+        iy, ix = getPointIndices(lon,lat,self.lon,self.lat)
         time = fp.variables['time_counter']
         m = re.search('months since\s+(\d+)-(\d+)-(\d+)',time.units)
         if m:
@@ -382,13 +458,10 @@ class ORAP5profile(object):
         for i,t in enumerate(time[:]):
             date = dates[i]
             if date.year in range(self.syr,self.eyr+1):
-                ldata.append(np.ma.array(fp.variables[self.ncname][i,:,iy,ix]).squeeze())
+                ldata.append(readPoints(fp.variables[self.ncname],(i,slice(None)),iy,ix)) # [z,point]
         fp.close()
         tavg_data = np.ma.mean(ldata,axis=0)
-        self.data = []
-        for lb in self.level_bounds:
-            iz = np.where((depth>=lb[0])&(depth<lb[1]))
-            self.data.append(tavg_data[iz].mean())
+        self.data = getPointData(getLayerMeans(depth,tavg_data,self.level_bounds),plon)
         self.depth = np.hstack((self.level_bounds[:,0],4000))
 
 class GSOP_GLORYS2V4profile(object):
@@ -403,6 +476,7 @@ class GSOP_GLORYS2V4profile(object):
         self.dset = dset
         self.vname = vname # T or S
         self.path = path
+        self.catalog = getCatalog(path)
         self.lat = plat
         self.lon = plon
         self.syr = syr
@@ -415,13 +489,12 @@ class GSOP_GLORYS2V4profile(object):
         else:
             fn = "%s_ORCA025_SC.nc" % (self.dset)
             varname = 'saltc'
-        fp = nc.Dataset(os.path.join(self.path,fn))
+        fp = nc.Dataset(self.catalog.getPath(fn))
         lat = np.array(fp.variables['lat'][:])
         lon = np.array(fp.variables['lon'][:])
         # transfer negative lons to positive
         lon[np.where(lon<0.)] += 360.
-        iy = np.where(np.abs(lat-self.lat)==np.min(np.abs(lat-self.lat)))[0][0]
-        ix = np.where(np.abs(lon-self.lon)==np.min(np.abs(lon-self.lon)))[0][0]
+        iy, ix = getPointIndices(lon,lat,self.lon,self.lat)
         time = fp.variables['time']
         cdftime = utime(time.units,calendar=time.calendar)
         dates = [cdftime.num2date(t) for t in time[:]]
@@ -436,22 +509,19 @@ class GSOP_GLORYS2V4profile(object):
             for i,t in enumerate(time[:]):
                 date = dates[i]
                 if date.year in range(self.syr,self.eyr+1):
-                    ldatal = fp.variables[ncnamel][i,iy,ix]
+                    ldatal = readPoints(fp.variables[ncnamel],(i,),iy,ix,float)
                     if ncnameu in ['z0heatc','z0saltc']:
                         ldata.append(ldatal/lb[1])
                     else:
-                        ldatau = fp.variables[ncnameu][i,iy,ix]
+                        ldatau = readPoints(fp.variables[ncnameu],(i,),iy,ix,float)
                         ldata.append((ldatal-ldatau)/(lb[1]-lb[0]))
-            data[li].append(np.ma.mean(ldata))
+            data[li] = np.ma.mean(ldata,axis=0)
         fp.close()
         if vname=='T':
-            self.data = np.ma.masked_equal(np.ma.squeeze(data),0)
+            self.data = np.ma.masked_equal(np.ma.array(data),0)
         else: #S
-            self.data = np.ma.masked_less_equal(np.ma.squeeze(data),32)
-            if self.data[-1]<self.data[-2]:
-                self.data[-1] = self.data[-2]
-            if self.data[-2]<self.data[-3]:
-                self.data[-1] = self.data[-2] = self.data[-3]
+            self.data = fixBottomSalinity(np.ma.masked_less_equal(np.ma.array(data),32))
+        self.data = getPointData(self.data,plon)
 
 class GSOP_GLORYS2V3profile(GSOP_GLORYS2V4profile):
     def __init__(self,vname,plon,plat,dset='GSOP_GLORYS2V3',\
@@ -556,15 +626,11 @@ class Experiments(object):
         tmin, tmax = np.ma.min(tdata), np.ma.max(tdata)
         smin, smax = np.ma.min(sdata), np.ma.max(sdata)
         xdim, ydim = round((smax-smin)/0.1+1,0), round((tmax-tmin)/0.1+1,0)
-        # Create empty grid of zeros
-        dens = np.zeros((ydim,xdim))
         # Create temp and salt vectors of appropiate dimensions
         ti = np.linspace(1,ydim-1,ydim)*0.1+tmin
         si = np.linspace(1,xdim-1,xdim)*0.1+smin
-        # Loop to fill in grid with densities
-        for j in range(0,int(ydim)):
-            for i in range(0, int(xdim)):
-                dens[j,i]=dens0(si[i],ti[j])
+        # Fill in grid with densities in one call
+        dens = dens0(*np.meshgrid(si,ti))
         # Substract 1000 to convert to sigma-t
         dens -= 1000
         for ia, ax in enumerate([ax1,ax2,ax3]):